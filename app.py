@@ -1,15 +1,33 @@
 from flask import Flask, request, jsonify
-from telegram import Bot
-from telegram.utils.request import Request
-from PIL import Image
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 import re
 import os
 import logging
+import threading
 from datetime import datetime
-import requests
 from pymongo import MongoClient
+from cachetools import TTLCache
+from telegram.error import BadRequest, Unauthorized
 from dotenv import load_dotenv
+from utils.address_index import AddressIndex
+from utils.circuit_breaker import CircuitOpen
+from utils.deadline import Deadline, DeadlineExceeded, StageStats
+from utils.dedupe import SignatureDeduplicator
+from utils.dispatcher import NotificationDispatcher
+from utils.helius import HeliusClient
+from utils.host_limiter import HostLimiter
+from utils.image_cache import ImageCache, ImageUnavailable
+from utils.image_delivery import DeliveryStrategy, ImageDeliverySelector
+from utils.image_utils import ImageDownloader, ImageProcessor, ImageTooLarge
+from utils.message_log import MessageLogWriter
+from utils.notifier import TelegramNotifier
+from utils.outbox import NotificationOutbox
+from utils.progressive import ProgressiveUpdates
+from utils.rate_limiter import SendGovernor
+from utils.schema import ensure_indexes
+from utils.token_cache import TokenMetadataCache
+from utils.token_store import TokenMetadataStore
+from utils.webhook_queue import WebhookQueue
 
 # Load environment variables
 load_dotenv()
@@ -18,6 +36,13 @@ load_dotenv()
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 MONGODB_URI = os.environ.get('MONGODB_URI')
 HELIUS_KEY = os.environ.get('HELIUS_KEY')
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+NOTIFIER_WORKERS = int(os.environ.get('NOTIFIER_WORKERS', 8))
+HELIUS_METADATA_BATCH_SIZE = 100
+# Send plain notifications as soon as watchers match, then edit in the enrichment
+PROGRESSIVE_NOTIFICATIONS = os.environ.get('PROGRESSIVE_NOTIFICATIONS', '1') == '1'
+# Seconds a webhook batch may spend on enrichment before optional stages are skipped
+ENRICHMENT_BUDGET = float(os.environ.get('ENRICHMENT_BUDGET', 4))
 
 class UserPlan:
     FREE = "free"
@@ -45,6 +70,117 @@ except Exception as e:
     logger.error(f"Failed to connect to MongoDB: {e}")
     raise
 
+# Enrichment calls fan out on a bounded pool, at most HOST_CONCURRENCY per host
+enrichment_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ENRICHMENT_WORKERS', 16)),
+    thread_name_prefix="enrichment"
+)
+host_limiter = HostLimiter(per_host=int(os.environ.get('HOST_CONCURRENCY', 8)))
+
+# Keep-alive Helius client with retries, shared by all webhook workers
+helius = HeliusClient(
+    HELIUS_KEY,
+    pool_size=int(os.environ.get('HELIUS_POOL_SIZE', 10)),
+    host_limiter=host_limiter,
+    max_retries=int(os.environ.get('HELIUS_MAX_RETRIES', 2)),
+    breaker_options={
+        "failure_rate": float(os.environ.get('HELIUS_BREAKER_FAILURE_RATE', 0.5)),
+        # Below ENRICHMENT_BUDGET, or calls clamped by the deadline could never count as slow
+        "slow_call_seconds": float(os.environ.get('HELIUS_BREAKER_SLOW_SECONDS', 2.5)),
+        "open_seconds": float(os.environ.get('HELIUS_BREAKER_OPEN_SECONDS', 30))
+    }
+)
+
+# Pairs plain notifications with their enriched follow-ups
+progressive = ProgressiveUpdates()
+
+# How often optional enrichment stages ran out of time
+enrichment_stages = StageStats()
+
+# Token metadata cache shared by all webhook workers
+token_store = TokenMetadataStore(
+    db,
+    info_ttl=int(os.environ.get('TOKEN_STORE_TTL', 7 * 86400)),
+    price_ttl=int(os.environ.get('TOKEN_PRICE_TTL', 60))
+)
+token_cache = TokenMetadataCache(
+    maxsize=int(os.environ.get('TOKEN_CACHE_SIZE', 10000)),
+    ttl=int(os.environ.get('TOKEN_CACHE_TTL', 6 * 3600)),
+    price_ttl=int(os.environ.get('TOKEN_PRICE_TTL', 60)),
+    backend=token_store
+)
+
+# Recently resolved user plans, kept briefly so upgrades show up quickly
+plan_cache = TTLCache(maxsize=50000, ttl=int(os.environ.get('PLAN_CACHE_TTL', 60)))
+plan_cache_lock = threading.Lock()
+
+# One Telegram bot and connection pool shared by all sender threads,
+# kept under Telegram's global and per-chat rate limits
+send_governor = SendGovernor(
+    global_rate=float(os.environ.get('TELEGRAM_GLOBAL_RATE', 30)),
+    per_chat_rate=float(os.environ.get('TELEGRAM_CHAT_RATE', 1))
+)
+notifier = TelegramNotifier(
+    BOT_TOKEN,
+    pool_size=int(os.environ.get('TELEGRAM_POOL_SIZE', NOTIFIER_WORKERS + 4)),
+    governor=send_governor
+)
+
+# Resized NFT images and their Telegram file_ids, so each image is uploaded once
+image_cache = ImageCache(
+    max_bytes=int(os.environ.get('IMAGE_CACHE_BYTES', 64 * 1024 * 1024)),
+    failure_ttl=int(os.environ.get('IMAGE_FAILURE_TTL', 300))
+)
+
+# Image decode/resize runs in worker processes
+image_delivery = ImageDeliverySelector(
+    allowed_hosts=os.environ.get(
+        'IMAGE_URL_HOSTS', 'arweave.net,ipfs.io,nftstorage.link,shdw-drive.genesysgo.net'
+    ).split(',')
+)
+image_downloader = ImageDownloader(
+    max_bytes=int(os.environ.get('IMAGE_MAX_BYTES', 5 * 1024 * 1024)),
+    timeout=float(os.environ.get('IMAGE_DOWNLOAD_TIMEOUT', 10))
+)
+image_processor = ImageProcessor(
+    workers=int(os.environ.get('IMAGE_WORKERS', os.cpu_count() or 2)),
+    timeout=float(os.environ.get('IMAGE_TIMEOUT', 10)),
+    max_pixels=int(os.environ.get('IMAGE_MAX_PIXELS', 40_000_000))
+)
+
+# Sender workers with a priority lane for premium users
+dispatcher = NotificationDispatcher(
+    workers=NOTIFIER_WORKERS,
+    priority_weight=int(os.environ.get('PRIORITY_WEIGHT', 3)),
+    governor=send_governor
+)
+
+# Every notification is kept until Telegram accepts it, failed sends are retried
+outbox = NotificationOutbox(
+    db,
+    max_attempts=int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 6))
+)
+
+# Active wallets held in memory so matching doesn't hit MongoDB
+address_index = AddressIndex(
+    db,
+    refresh_interval=int(os.environ.get('ADDRESS_INDEX_REFRESH', 60)),
+    max_staleness=int(os.environ.get('ADDRESS_INDEX_MAX_STALENESS', 300))
+)
+
+# Signatures already processed, so Helius retries don't notify twice
+deduplicator = SignatureDeduplicator(
+    db,
+    ttl=int(os.environ.get('PROCESSED_SIGNATURE_TTL', 86400))
+)
+
+# Message log records are written in batches off the send path
+message_log = MessageLogWriter(
+    db.messages,
+    flush_size=int(os.environ.get('MESSAGE_LOG_FLUSH_SIZE', 100)),
+    flush_interval=float(os.environ.get('MESSAGE_LOG_FLUSH_INTERVAL', 1.0))
+)
+
 def format_number(number, decimals=2):
     try:
         if number >= 1_000_000:
@@ -56,61 +192,108 @@ def format_number(number, decimals=2):
     except:
         return str(number)
 
-def get_token_info(token_address):
+def fetch_metadata_chunk(chunk, deadline=None):
+    """Fetch metadata and price for up to HELIUS_METADATA_BATCH_SIZE mints in one request"""
+    if deadline is not None and deadline.expired():
+        logger.warning(f"Deadline passed, skipping metadata for {len(chunk)} mints")
+        return {}
     try:
-        url = f"https://api.helius.xyz/v0/token-metadata?api-key={HELIUS_KEY}"
-        response = requests.post(url, json={"mintAccounts": [token_address]})
-        if response.status_code == 200:
-            data = response.json()[0]
-            return {
-                "symbol": data.get("symbol", ""),
-                "name": data.get("name", ""),
-                "decimals": data.get("decimals", 9)
-            }
-        return None
+        response = helius.token_metadata(chunk, deadline=deadline)
+        if response.status_code != 200:
+            logger.error(f"Helius token metadata returned {response.status_code}")
+            return {}
+        entries = response.json()
+    except (CircuitOpen, DeadlineExceeded) as e:
+        # Helius is struggling or we're out of time; callers make do with cached metadata
+        logger.warning(f"Skipping metadata for {len(chunk)} mints: {e}")
+        return {}
     except Exception as e:
-        logger.error(f"Error getting token info: {e}")
-        return None
+        logger.error(f"Error getting token metadata: {e}")
+        return {}
 
-def send_message_to_user(bot_token, user_id, message):
-    try:
-        request = Request(con_pool_size=8)
-        bot = Bot(bot_token, request=request)
-        bot.send_message(
-            chat_id=user_id,
-            text=message,
-            parse_mode="Markdown",
-            disable_web_page_preview=True)
-        logger.info(f"Message sent to user {user_id}")
-    except Exception as e:
-        logger.error(f"Error sending message to user {user_id}: {e}")
+    results = {}
+    for mint, data in zip(chunk, entries):
+        if not data:
+            results[mint] = None
+            continue
+        results[mint] = {
+            "symbol": data.get("symbol", ""),
+            "name": data.get("name", ""),
+            "decimals": data.get("decimals", 9),
+            "price": data.get("price")
+        }
+    for mint in chunk[len(entries):]:
+        results[mint] = None
+    return results
+
+def fetch_token_metadata(mints, deadline=None):
+    """Fetch metadata and price for many mints, requesting the chunks concurrently"""
+    chunks = [
+        mints[i:i + HELIUS_METADATA_BATCH_SIZE]
+        for i in range(0, len(mints), HELIUS_METADATA_BATCH_SIZE)
+    ]
+    results = {}
+    if len(chunks) == 1:
+        results.update(fetch_metadata_chunk(chunks[0], deadline))
+        return results
+    futures = [enrichment_executor.submit(fetch_metadata_chunk, chunk, deadline) for chunk in chunks]
+    for future in futures:
+        results.update(future.result())
+    return results
+
+def send_message_to_user(user_id, message):
+    sent = notifier.send_message(user_id, message)
+    logger.info(f"Message sent to user {user_id}")
+    return sent
+
+def send_cached_photo(user_id, message, image_url, **send_options):
+    """Send the image by Telegram file_id if it was sent before, else by URL or upload"""
+    file_id = image_cache.get_file_id(image_url)
+    if file_id:
+        try:
+            return notifier.send_photo(user_id, file_id, message, **send_options)
+        except BadRequest as e:
+            logger.warning(f"Cached file_id for {image_url} was rejected, uploading again: {e}")
+            image_cache.forget_file_id(image_url)
+
+    if image_delivery.choose(image_url) == DeliveryStrategy.URL:
+        # Let Telegram fetch the image itself; only download it if that fails
+        try:
+            sent = notifier.send_photo(user_id, image_url, message, **send_options)
+            image_delivery.record(image_url, DeliveryStrategy.URL, True)
+            if sent and sent.photo:
+                image_cache.set_file_id(image_url, sent.photo[-1].file_id)
+            return sent
+        except BadRequest as e:
+            image_delivery.record(image_url, DeliveryStrategy.URL, False)
+            logger.info(f"Telegram couldn't fetch {image_url}, uploading it instead: {e}")
 
-def send_image_to_user(bot_token, user_id, message, image_url):
+    image_bytes = image_cache.get_or_load(image_url, get_image)
+    sent = notifier.send_photo(user_id, image_bytes, message, **send_options)
+    image_delivery.record(image_url, DeliveryStrategy.UPLOAD, True)
+    if sent and sent.photo:
+        image_cache.set_file_id(image_url, sent.photo[-1].file_id)
+    return sent
+
+def send_image_to_user(user_id, message, image_url):
     try:
-        request = Request(con_pool_size=8)
-        bot = Bot(bot_token, request=request)
-        image_bytes = get_image(image_url)
-        bot.send_photo(
-            chat_id=user_id,
-            photo=image_bytes,
-            caption=message,
-            parse_mode="Markdown")
+        sent = send_cached_photo(user_id, message, image_url)
         logger.info(f"Image sent to user {user_id}")
+        return sent
+    except (ImageTooLarge, ImageUnavailable) as e:
+        logger.warning(f"Skipping image for user {user_id}, sending text only: {e}")
+        return send_message_to_user(user_id, message)
     except Exception as e:
         logger.error(f"Error sending image to user {user_id}: {e}")
-        send_message_to_user(bot_token, user_id, message)
+        return send_message_to_user(user_id, message)
 
 def get_image(url):
     try:
-        response = requests.get(url, timeout=10).content
-        image = Image.open(BytesIO(response))
-        image = image.convert('RGB')
-        max_size = (800, 800)
-        image.thumbnail(max_size, Image.LANCZOS)
-        image_bytes = BytesIO()
-        image.save(image_bytes, 'JPEG', quality=85)
-        image_bytes.seek(0)
-        return image_bytes
+        data = image_downloader.fetch(url)
+        # Decode and resize in the process pool, off this thread
+        return image_processor.process(data)
+    except ImageTooLarge:
+        raise
     except Exception as e:
         logger.error(f"Error getting image from {url}: {e}")
         raise
@@ -123,59 +306,34 @@ def format_wallet_address(match_obj):
         logger.error(f"Error formatting wallet address: {e}")
         return match_obj.group(0)
 
-def get_token_price(token_address):
+def get_compressed_image(asset_id, deadline=None):
     try:
-        url = f"https://api.helius.xyz/v0/token-metadata?api-key={HELIUS_KEY}"
-        response = requests.post(url, json={"mintAccounts": [token_address]})
-        if response.status_code == 200:
-            data = response.json()[0]
-            if 'price' in data:
-                return data['price']
-        return None
-    except Exception as e:
-        logger.error(f"Error getting token price: {e}")
-        return None
-
-def get_compressed_image(asset_id):
-    try:
-        url = f'https://rpc.helius.xyz/?api-key={HELIUS_KEY}'
-        r_data = {
-            "jsonrpc": "2.0",
-            "id": "my-id",
-            "method": "getAsset",
-            "params": [asset_id]
-        }
-        response = requests.post(url, json=r_data, timeout=10)
+        response = helius.get_asset(asset_id, deadline=deadline)
         if response.status_code != 200:
             logger.error(f"Error response from Helius: {response.status_code}")
             return ''
         url_meta = response.json()['result']['content']['json_uri']
-        r = requests.get(url=url_meta, timeout=10)
+        r = helius.offchain_metadata(url_meta, deadline=deadline)
         if r.status_code != 200:
             logger.error(f"Error getting metadata: {r.status_code}")
             return ''
         return r.json()['image']
+    except (CircuitOpen, DeadlineExceeded) as e:
+        logger.warning(f"Skipping compressed image for asset {asset_id}: {e}")
+        return ''
     except Exception as e:
         logger.error(f"Error getting compressed image for asset {asset_id}: {e}")
         return ''
 
-def check_image(data):
+def check_image(transaction, deadline=None):
     try:
         token_mint = ''
-        for token in data[0]['tokenTransfers']:
+        for token in transaction.get('tokenTransfers', []):
             if 'NonFungible' in token['tokenStandard']:
                 token_mint = token['mint']
         
         if len(token_mint) > 0:
-            url = f"https://api.helius.xyz/v0/token-metadata?api-key={HELIUS_KEY}"
-            nft_addresses = [token_mint]
-            r_data = {
-                "mintAccounts": nft_addresses,
-                "includeOffChain": True,
-                "disableCache": False,
-            }
-
-            r = requests.post(url=url, json=r_data, timeout=10)
+            r = helius.token_metadata([token_mint], include_off_chain=True, deadline=deadline)
             j = r.json()
             if 'metadata' not in j[0]['offChainMetadata']:
                 return ''
@@ -184,20 +342,34 @@ def check_image(data):
             image = j[0]['offChainMetadata']['metadata']['image']
             return image
         else:
-            if 'compressed' in data[0]['events']:
-                if 'assetId' in data[0]['events']['compressed'][0]:
-                    asset_id = data[0]['events']['compressed'][0]['assetId']
+            events = transaction.get('events', {})
+            if 'compressed' in events:
+                if 'assetId' in events['compressed'][0]:
+                    asset_id = events['compressed'][0]['assetId']
                     try:
-                        image = get_compressed_image(asset_id)
+                        image = get_compressed_image(asset_id, deadline)
                         return image
                     except:
                         return ''
             return ''
+    except (CircuitOpen, DeadlineExceeded) as e:
+        logger.warning(f"Skipping image lookup: {e}")
+        return ''
     except Exception as e:
         logger.error(f"Error checking image: {e}")
         return ''
 
-def process_token_transfers(transfers, tx_type):
+def lookup_image(transaction, deadline):
+    """The transaction's NFT image URL, unless the enrichment deadline already passed"""
+    if deadline.expired():
+        enrichment_stages.record('image', skipped=True)
+        return ''
+    image = check_image(transaction, deadline)
+    # A lookup the deadline cut short counts as skipped too
+    enrichment_stages.record('image', skipped=not image and deadline.expired())
+    return image
+
+def process_token_transfers(transfers, tx_type, token_infos, token_prices):
     try:
         result = {
             'amount_in': 0,
@@ -209,11 +381,11 @@ def process_token_transfers(transfers, tx_type):
         
         for transfer in transfers:
             amount = float(transfer.get('tokenAmount', 0))
-            token_info = get_token_info(transfer.get('mint', ''))
+            token_info = token_infos.get(transfer.get('mint', ''))
             
             if token_info:
                 if transfer.get('tokenStandard') == 'Fungible':
-                    price = get_token_price(transfer.get('mint', ''))
+                    price = token_prices.get(transfer.get('mint', ''))
                     if price:
                         result['usd_value'] += amount * price
 
@@ -231,116 +403,274 @@ def process_token_transfers(transfers, tx_type):
         logger.error(f"Error processing token transfers: {e}")
         return None
 
-def create_message(data):
+def extract_accounts(transaction):
+    accounts = []
+    for inst in transaction.get("instructions", []):
+        accounts.extend(inst["accounts"])
+
+    for token in transaction.get('tokenTransfers', []):
+        accounts.append(token['fromUserAccount'])
+        accounts.append(token['toUserAccount'])
+
+    return list(set(accounts))
+
+def fetch_batch_token_data(transactions, deadline=None):
+    """Look up metadata, then prices, for every unique mint in the batch at once.
+
+    Prices are optional: they're skipped once ``deadline`` has passed.
+    """
+    mints = set()
+    fungible_mints = set()
+    for transaction in transactions:
+        for transfer in transaction.get('tokenTransfers', []):
+            mints.add(transfer.get('mint', ''))
+            if transfer.get('tokenStandard') == 'Fungible':
+                fungible_mints.add(transfer.get('mint', ''))
+    mints.discard('')
+
+    def fetch_many(batch):
+        return fetch_token_metadata(batch, deadline)
+
     try:
-        logger.info(f"Processing transaction data: {data}")
-        
-        tx_type = data[0]['type'].replace("_", " ")
-        tx = data[0]['signature']
-        source = data[0]['source']
-        description = data[0]['description']
+        token_infos, _ = token_cache.get_many(mints, fetch_many)
+    except Exception as e:
+        logger.error(f"Error getting token data: {e}")
+        return {}, {}
+
+    price_transactions = sum(
+        1 for transaction in transactions
+        if any(transfer.get('mint') in fungible_mints for transfer in transaction.get('tokenTransfers', []))
+    )
+    if deadline is not None and deadline.expired():
+        enrichment_stages.record('price', skipped=True, count=price_transactions)
+        return token_infos, {}
+
+    known_mints = [mint for mint in fungible_mints if token_infos.get(mint)]
+    try:
+        token_prices = token_cache.get_prices(known_mints, fetch_many)
+    except Exception as e:
+        logger.error(f"Error getting token prices: {e}")
+        token_prices = {}
+    # Prices the deadline cut short count as skipped too
+    cut_short = deadline is not None and deadline.expired() and len(token_prices) < len(known_mints)
+    enrichment_stages.record('price', skipped=cut_short, count=price_transactions)
+    return token_infos, token_prices
+
+def build_transaction_text(transaction, token_infos, token_prices):
+    tx_type = transaction['type'].replace("_", " ")
+    tx = transaction['signature']
+    source = transaction['source']
+    description = transaction['description']
 
-        # Process token transfers
-        token_data = process_token_transfers(data[0].get('tokenTransfers', []), tx_type)
+    # Process token transfers
+    token_data = process_token_transfers(
+        transaction.get('tokenTransfers', []),
+        tx_type,
+        token_infos,
+        token_prices
+    )
+    
+    # Build message based on transaction type
+    if tx_type == "SWAP":
+        message = f"{'🔴 SELL' if source == 'RAYDIUM' else '🟢 BUY'} "
+        if token_data and token_data['token_in'] and token_data['token_out']:
+            message += (
+                f"{token_data['token_in']['symbol']} on {source}\n\n"
+                f"🔹 Amount: {format_number(token_data['amount_in'])} "
+                f"{token_data['token_in']['symbol']}"
+            )
+            if token_data['usd_value'] > 0:
+                message += f" (${format_number(token_data['usd_value'])})"
+            message += (
+                f"\n🔹 For: {format_number(token_data['amount_out'])} "
+                f"{token_data['token_out']['symbol']}"
+            )
+        else:
+            # No token metadata (yet), e.g. the plain progressive notification
+            message += f"on {source}"
+
+        # Add token links
+        token_transfers = transaction.get('tokenTransfers', [])
+        token_mint = token_transfers[0].get('mint', '') if token_transfers else ''
+        if token_mint:
+            message += (
+                f"\n\n🔗 Links:\n"
+                f"• [Birdeye](https://birdeye.so/token/{token_mint})\n"
+                f"• [DexScreener](https://dexscreener.com/solana/{token_mint})\n"
+                f"• [Solscan](https://solscan.io/token/{token_mint})"
+            )
+    elif tx_type == "NFT SALE" or tx_type == "NFT PURCHASE":
+        symbol = ""
+        amount = 0
+        for transfer in transaction['tokenTransfers']:
+            if transfer.get('tokenStandard') == 'NonFungible':
+                symbol = transfer.get('symbol', '')
+            elif transfer.get('tokenStandard') == 'Fungible':
+                amount = float(transfer.get('tokenAmount', 0))
         
-        # Build message based on transaction type
-        if tx_type == "SWAP":
-            message = f"{'🔴 SELL' if source == 'RAYDIUM' else '🟢 BUY'} "
-            if token_data and token_data['token_in'] and token_data['token_out']:
-                message += (
-                    f"{token_data['token_in']['symbol']} on {source}\n\n"
-                    f"🔹 Amount: {format_number(token_data['amount_in'])} "
-                    f"{token_data['token_in']['symbol']}"
-                )
-                if token_data['usd_value'] > 0:
-                    message += f" (${format_number(token_data['usd_value'])})"
-                message += (
-                    f"\n🔹 For: {format_number(token_data['amount_out'])} "
-                    f"{token_data['token_out']['symbol']}"
+        message = (
+            f"{'🔴 SOLD' if tx_type == 'NFT SALE' else '🟢 BOUGHT'} "
+            f"{symbol} on {source}\n"
+            f"💰 Price: {format_number(amount)} SOL"
+        )
+    else:
+        message = f"*{tx_type}* on {source}\n\n"
+        if description:
+            message += description
+
+    # Add transaction links
+    message += f"\n\n[XRAY](https://xray.helius.xyz/tx/{tx}) | [Solscan](https://solscan.io/tx/{tx})"
+    return message
+
+def match_watchers(transactions):
+    """Return the watching wallet docs for each transaction, in batch order"""
+    # One watcher lookup for the whole batch
+    tx_accounts = [extract_accounts(transaction) for transaction in transactions]
+    all_accounts = list(set(address for accounts in tx_accounts for address in accounts))
+    wallets_by_address = {}
+    for doc in address_index.match(all_accounts):
+        wallets_by_address.setdefault(doc['address'], []).append(doc)
+
+    return [
+        [doc for address in accounts for doc in wallets_by_address.get(address, [])]
+        for accounts in tx_accounts
+    ]
+
+def get_premium_users(user_ids):
+    """Return the subset of ``user_ids`` on the premium plan, one query for all cache misses"""
+    premium = set()
+    missing = []
+    with plan_cache_lock:
+        for user_id in set(user_ids):
+            if user_id in plan_cache:
+                if plan_cache[user_id]:
+                    premium.add(user_id)
+            else:
+                missing.append(user_id)
+
+    if missing:
+        try:
+            found = set(
+                doc['user_id']
+                for doc in db.users.find(
+                    {"user_id": {"$in": missing}, "plan": UserPlan.PREMIUM},
+                    {"_id": 0, "user_id": 1}
                 )
-                
-                # Add token links
-                token_mint = data[0]['tokenTransfers'][0].get('mint', '')
-                if token_mint:
-                    message += (
-                        f"\n\n🔗 Links:\n"
-                        f"• [Birdeye](https://birdeye.so/token/{token_mint})\n"
-                        f"• [DexScreener](https://dexscreener.com/solana/{token_mint})\n"
-                        f"• [Solscan](https://solscan.io/token/{token_mint})"
-                    )
-        elif tx_type == "NFT SALE" or tx_type == "NFT PURCHASE":
-            symbol = ""
-            amount = 0
-            for transfer in data[0]['tokenTransfers']:
-                if transfer.get('tokenStandard') == 'NonFungible':
-                    symbol = transfer.get('symbol', '')
-                elif transfer.get('tokenStandard') == 'Fungible':
-                    amount = float(transfer.get('tokenAmount', 0))
-            
-            message = (
-                f"{'🔴 SOLD' if tx_type == 'NFT SALE' else '🟢 BOUGHT'} "
-                f"{symbol} on {source}\n"
-                f"💰 Price: {format_number(amount)} SOL"
             )
-        else:
-            message = f"*{tx_type}* on {source}\n\n"
-            if description:
-                message += description
+        except Exception as e:
+            logger.error(f"Error getting user plans: {e}")
+            return premium
 
-        # Add transaction links
-        message += f"\n\n[XRAY](https://xray.helius.xyz/tx/{tx}) | [Solscan](https://solscan.io/tx/{tx})"
+        premium |= found
+        with plan_cache_lock:
+            for user_id in missing:
+                plan_cache[user_id] = user_id in found
 
-        # Process accounts
-        accounts = []
-        for inst in data[0]["instructions"]:
-            accounts.extend(inst["accounts"])
-        
-        if data[0]['tokenTransfers']:
-            for token in data[0]['tokenTransfers']:
-                accounts.append(token['fromUserAccount'])
-                accounts.append(token['toUserAccount'])
-            accounts = list(set(accounts))
+    return premium
 
-        image = check_image(data)
-        
-        # Find affected wallets
-        found_docs = list(db.wallets.find({
-            "address": {"$in": accounts},
-            "status": "active"
-        }))
-        
-        found_users = list(set(doc['user_id'] for doc in found_docs))
-        logger.info(f"Found users for notification: {found_users}")
+def create_transaction_messages(message, image, found_docs, premium_users):
+    found_users = list(set(doc['user_id'] for doc in found_docs))
+    logger.info(f"Found users for notification: {found_users}")
+    
+    messages = []
+    for user in found_users:
+        user_message = message
+        user_wallets = [doc for doc in found_docs if doc['user_id'] == user]
         
-        messages = []
-        for user in found_users:
-            user_message = message
-            user_wallets = [doc for doc in found_docs if doc['user_id'] == user]
-            
-            # Replace wallet addresses with names
-            for wallet in user_wallets:
-                if wallet['address'] in user_message:
-                    wallet_name = wallet.get('name', f"{wallet['address'][:4]}...{wallet['address'][-4:]}")
-                    user_message = user_message.replace(
-                        wallet['address'], 
-                        f"*{wallet_name}*"
-                    )
-
-            # Format remaining addresses
-            user_message = re.sub(r'[A-Za-z0-9]{32,44}', format_wallet_address, user_message)
-            
-            messages.append({
-                'user': user,
-                'text': user_message,
-                'image': image,
-                'priority': db.users.find_one({"user_id": user, "plan": UserPlan.PREMIUM}) is not None
-            })
+        # Replace wallet addresses with names
+        for wallet in user_wallets:
+            if wallet['address'] in user_message:
+                wallet_name = wallet.get('name', f"{wallet['address'][:4]}...{wallet['address'][-4:]}")
+                user_message = user_message.replace(
+                    wallet['address'], 
+                    f"*{wallet_name}*"
+                )
+
+        # Format remaining addresses
+        user_message = re.sub(r'[A-Za-z0-9]{32,44}', format_wallet_address, user_message)
         
-        return messages
-    except Exception as e:
-        logger.error(f"Error creating message: {e}")
-        logger.error(f"Data that caused error: {data}")
-        return []
+        messages.append({
+            'user': user,
+            'text': user_message,
+            'image': image,
+            'priority': user in premium_users
+        })
+    
+    return messages
+
+def match_recipients(transactions):
+    """Watching wallet docs for each transaction and the premium users among them"""
+    logger.info(f"Processing transaction data: {transactions}")
+
+    # Stages 1 and 2: extract accounts and match watchers
+    tx_watchers = match_watchers(transactions)
+    logger.info(f"{sum(1 for watchers in tx_watchers if watchers)} of {len(transactions)} transactions have watchers")
+
+    # Plans for every recipient in the batch in one lookup
+    premium_users = get_premium_users(
+        doc['user_id'] for watchers in tx_watchers for doc in watchers
+    )
+    return tx_watchers, premium_users
+
+def create_message(data, enrich_tokens=True, fetch_images=True, recipients=None):
+    """Build notifications for every transaction in a Helius webhook batch.
+
+    Runs in stages: extract accounts, match watchers, then enrich only the
+    transactions someone is watching. Token enrichment and image lookup can
+    be skipped with ``enrich_tokens`` / ``fetch_images``. Enrichment shares
+    an ENRICHMENT_BUDGET deadline; once it passes, prices and images are
+    skipped and a plain notification goes out instead. ``recipients`` from
+    an earlier ``match_recipients`` call on the same batch skips matching.
+
+    Returns one result per transaction with its signature, type and the
+    messages for the users watching any of its accounts; ``error`` is set on
+    a transaction whose messages couldn't be built. Errors matching
+    watchers are raised, so a queued webhook is retried rather than dropped.
+    """
+    # The transactions in a webhook arrive together, so they share one deadline
+    deadline = Deadline(ENRICHMENT_BUDGET)
+    transactions = data if isinstance(data, list) else [data]
+    tx_watchers, premium_users = recipients or match_recipients(transactions)
+    matched = [
+        transaction
+        for transaction, watchers in zip(transactions, tx_watchers)
+        if watchers
+    ]
+
+    # Stage 3: enrichment, only for transactions with recipients. Image
+    # lookups run on the enrichment pool while token data is fetched here,
+    # so the batch takes as long as the slowest call rather than their sum
+    image_futures = {}
+    if fetch_images:
+        for index, transaction in enumerate(transactions):
+            if tx_watchers[index]:
+                image_futures[index] = enrichment_executor.submit(lookup_image, transaction, deadline)
+
+    token_infos, token_prices = {}, {}
+    if enrich_tokens and matched:
+        token_infos, token_prices = fetch_batch_token_data(matched, deadline)
+
+    results = []
+    for index, (transaction, watchers) in enumerate(zip(transactions, tx_watchers)):
+        result = {
+            'signature': transaction.get('signature', ''),
+            'tx_type': transaction.get('type', ''),
+            'messages': []
+        }
+        results.append(result)
+        if not watchers:
+            continue
+
+        try:
+            message = build_transaction_text(transaction, token_infos, token_prices)
+            image = image_futures[index].result() if index in image_futures else ''
+            result['messages'] = create_transaction_messages(message, image, watchers, premium_users)
+        except Exception as e:
+            result['error'] = True
+            logger.error(f"Error creating message for transaction {result['signature']}: {e}")
+            logger.error(f"Data that caused error: {transaction}")
+    
+    return results
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -409,11 +739,15 @@ def test_message():
             return jsonify({"error": "Request must be JSON"}), 400
 
         data = request.json
-        messages = create_message(data)
+        results = create_message(
+            data,
+            enrich_tokens=request.args.get('enrich', '1') != '0',
+            fetch_images=request.args.get('images', '1') != '0'
+        )
         
         return jsonify({
             "status": "ok",
-            "messages": messages
+            "transactions": results
         }), 200
     except Exception as e:
         logger.error(f"Test message failed: {e}")
@@ -422,9 +756,280 @@ def test_message():
             "error": str(e)
         }), 500
 
+def deliver_notification(notification):
+    """Send one outbox notification and record the outcome.
+
+    send_image_to_user already falls back to text, so a failure here means
+    the text couldn't be sent either. If the enriched version of a plain
+    notification is ready by now it's sent instead; if it arrives while the
+    plain one is being sent, it's applied as an edit afterwards. A
+    notification that was sent or dispatched again while this job waited in
+    the queue is skipped.
+    """
+    try:
+        claimed = outbox.claim(notification)
+    except Exception as e:
+        # Left pending, the outbox dispatches it again once it's stale
+        logger.error(f"Error claiming notification {notification['_id']}: {e}")
+        return
+    if claimed is None:
+        return
+    notification = claimed
+
+    update = progressive.before_send(notification['_id'])
+    text, image = update or (notification['text'], notification.get('image'))
+    try:
+        if image:
+            sent = send_image_to_user(notification['user'], text, image)
+        else:
+            sent = send_message_to_user(notification['user'], text)
+    except (Unauthorized, BadRequest) as e:
+        # The user blocked the bot or the message is malformed, retrying won't help
+        outbox.mark_failed(notification, e, permanent=True)
+        return
+    except Exception as e:
+        logger.error(f"Error sending notification to user {notification['user']}: {e}")
+        outbox.mark_failed(notification, e)
+        return
+
+    message_id = sent.message_id if sent else None
+    outbox.mark_sent(notification, message_id)
+    if update is None and message_id is not None:
+        late_update = progressive.after_send(notification['_id'], message_id)
+        if late_update:
+            dispatch_update(notification, message_id, *late_update)
+
+def apply_update(notification, message_id, text, image):
+    """Upgrade a sent plain notification with its enrichment.
+
+    Telegram can't turn a text message into a photo, so the image follows as
+    a silent reply to it instead of replacing it.
+    """
+    user_id = notification['user']
+    try:
+        if text != notification['text']:
+            notifier.edit_message_text(user_id, message_id, text)
+        if image:
+            send_cached_photo(user_id, None, image, reply_to_message_id=message_id, disable_notification=True)
+    except BadRequest as e:
+        if 'not modified' not in str(e).lower():
+            logger.warning(f"Error updating notification for user {user_id}: {e}")
+    except Exception as e:
+        logger.warning(f"Error updating notification for user {user_id}: {e}")
+
+def dispatch_update(notification, message_id, text, image):
+    # Called from dispatcher workers, which would deadlock waiting for room in their own queue
+    dispatcher.submit(
+        lambda: apply_update(notification, message_id, text, image),
+        priority=notification.get('priority', False),
+        chat_id=notification['user'],
+        block=False
+    )
+
+def dispatch_notification(notification):
+    dispatcher.submit(
+        lambda: deliver_notification(notification),
+        priority=notification.get('priority', False),
+        chat_id=notification['user']
+    )
+
+def process_webhook(data, queue_id=None):
+    """Build and send notifications for a queued webhook payload"""
+    # Drop transactions Helius already delivered before doing any work. The
+    # claim is tied to the queue item, so if we die before the outbox has the
+    # notifications, the queue's redelivery of the item isn't dropped
+    transactions = data if isinstance(data, list) else [data]
+    fresh = deduplicator.claim_many(
+        (transaction['signature'] for transaction in transactions if transaction.get('signature')),
+        owner=queue_id
+    )
+    unique_transactions = []
+    for transaction in transactions:
+        signature = transaction.get('signature')
+        if not signature or signature in fresh:
+            unique_transactions.append(transaction)
+            fresh.discard(signature)
+    transactions = unique_transactions
+    if not transactions:
+        logger.info("Skipping webhook, all transactions were already processed")
+        return
+
+    try:
+        failed = queue_notifications(transactions)
+    except Exception:
+        # Let the queue's retry process these transactions again
+        deduplicator.release(
+            transaction['signature'] for transaction in transactions if transaction.get('signature')
+        )
+        raise
+
+    if failed:
+        # Nobody was notified about these, so a redelivery must not be dropped as a duplicate
+        logger.warning(f"Releasing {len(failed)} signatures whose messages couldn't be built")
+        deduplicator.release(failed)
+
+def queue_notifications(transactions):
+    """Build notifications for ``transactions`` and hand them to the outbox and dispatcher.
+
+    With PROGRESSIVE_NOTIFICATIONS the plain text goes out as soon as the
+    watchers are matched, and token, price and image enrichment follows as
+    an update, so Helius latency no longer delays the first notification.
+
+    Returns the signatures of transactions whose messages couldn't be built.
+    """
+    if not PROGRESSIVE_NOTIFICATIONS:
+        results = create_message(transactions)
+        store_and_dispatch(results)
+        return failed_signatures(results)
+
+    # Plain notifications first, without any Helius calls
+    recipients = match_recipients(transactions)
+    results = create_message(transactions, enrich_tokens=False, fetch_images=False, recipients=recipients)
+    notifications = store_and_dispatch(results, log_messages=False)
+    if not notifications:
+        return failed_signatures(results)
+
+    # Then enrich and upgrade whatever changed. The message log gets the
+    # final text, once per notification
+    final_text = {notification['_id']: notification['text'] for notification in notifications}
+    try:
+        enriched = {
+            (result['signature'], message['user']): message
+            for result in create_message(transactions, recipients=recipients)
+            for message in result['messages']
+        }
+        for notification in notifications:
+            message = enriched.get((notification['tx_signature'], notification['user']))
+            if message is None or (message['text'] == notification['text'] and not message.get('image')):
+                continue
+            enrich_notification(notification, message['text'], message.get('image', ''))
+            final_text[notification['_id']] = message['text']
+    except Exception as e:
+        # The plain notifications are already queued, a retry would send them twice
+        logger.error(f"Error enriching notifications: {e}")
+    finally:
+        for notification in notifications:
+            log_message(notification, final_text[notification['_id']])
+    return failed_signatures(results)
+
+def failed_signatures(results):
+    return [result['signature'] for result in results if result.get('error') and result['signature']]
+
+def enrich_notification(notification, text, image):
+    # Retries of a plain notification that hasn't gone out yet send the enriched one
+    outbox.update_content(notification, text, image)
+    message_id = progressive.enriched(notification['_id'], text, image)
+    if message_id is not None:
+        dispatch_update(notification, message_id, text, image)
+
+def log_message(notification, text):
+    message_log.add({
+        "user": notification['user'],
+        "message": text,
+        "datetime": datetime.now(),
+        "priority": notification.get('priority', False),
+        "tx_signature": notification['tx_signature'],
+        "tx_type": notification['tx_type']
+    })
+
+def store_and_dispatch(results, log_messages=True):
+    """Log and record ``create_message`` results in the outbox, then dispatch them.
+
+    With ``log_messages`` off the caller logs them itself, once it knows the
+    text that was finally sent.
+    """
+    logger.info(f"Created messages: {results}")
+
+    # Log every message and record it in the outbox before sending
+    notifications = []
+    for result in results:
+        for message in result['messages']:
+            notifications.append({
+                "user": message['user'],
+                "text": message['text'],
+                "image": message.get('image', ''),
+                "priority": message.get('priority', False),
+                "tx_signature": result['signature'],
+                "tx_type": result['tx_type']
+            })
+
+    if log_messages:
+        for notification in notifications:
+            log_message(notification, notification['text'])
+
+    # Hand notifications to the dispatcher, premium users first
+    notifications = outbox.add_many(notifications)
+    for notification in notifications:
+        dispatch_notification(notification)
+
+    logger.info(f"Webhook processed: {len(results)} transactions, {len(notifications)} messages queued")
+    return notifications
+
+webhook_queue = WebhookQueue(db, process_webhook, workers=WEBHOOK_WORKERS)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Runtime metrics for sizing the webhook service"""
+    try:
+        return jsonify({
+            "timestamp": datetime.now().isoformat(),
+            "queue": webhook_queue.stats(),
+            "helius": helius.stats(),
+            "host_limiter": host_limiter.stats(),
+            "enrichment_stages": enrichment_stages.stats(),
+            "progressive": progressive.stats(),
+            "token_cache": token_cache.stats(),
+            "address_index": address_index.stats(),
+            "dedupe": deduplicator.stats(),
+            "message_log": message_log.stats(),
+            "dispatcher": dispatcher.stats(),
+            "send_governor": send_governor.stats(),
+            "outbox": outbox.stats(),
+            "image_cache": image_cache.stats(),
+            "image_delivery": image_delivery.stats(),
+            "image_downloader": image_downloader.stats(),
+            "image_processor": image_processor.stats()
+        }), 200
+    except Exception as e:
+        logger.error(f"Metrics failed: {e}")
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), 500
+
+@app.route('/outbox/dead-letters', methods=['GET'])
+def dead_letters():
+    """Notifications that exhausted their retries, newest first"""
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        letters = [
+            {
+                "id": str(doc['_id']),
+                "user": doc.get('user'),
+                "text": doc.get('text'),
+                "tx_signature": doc.get('tx_signature'),
+                "attempts": doc.get('attempts', 0),
+                "last_error": doc.get('last_error'),
+                "created_at": doc['created_at'].isoformat() if doc.get('created_at') else None,
+                "dead_at": doc['dead_at'].isoformat() if doc.get('dead_at') else None
+            }
+            for doc in outbox.dead_letters(limit)
+        ]
+        return jsonify({
+            "status": "ok",
+            "count": len(letters),
+            "dead_letters": letters
+        }), 200
+    except Exception as e:
+        logger.error(f"Dead letter listing failed: {e}")
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), 500
+
 @app.route('/wallet', methods=['POST'])
 def handle_webhook():
-    """Main webhook endpoint"""
+    """Main webhook endpoint, queues the payload and acks immediately"""
     try:
         logger.info(f"Received webhook request: {request.headers}")
         
@@ -438,60 +1043,16 @@ def handle_webhook():
             logger.error("Invalid request: Empty data")
             return jsonify({"error": "Empty data"}), 400
 
-        logger.info(f"Processing webhook data: {data}")
-        
-        # Create messages for all affected users
-        messages = create_message(data)
-        logger.info(f"Created messages: {messages}")
-
-        # Send messages to users
-        for message in messages:
-            try:
-                # Save message to database
-                db_entry = {
-                    "user": message['user'],
-                    "message": message['text'],
-                    "datetime": datetime.now(),
-                    "priority": message.get('priority', False),
-                    "tx_signature": data[0].get('signature', ''),
-                    "tx_type": data[0].get('type', '')
-                }
-                db.messages.insert_one(db_entry)
-                logger.info(f"Saved message to database: {db_entry['_id']}")
-
-                # Send notification
-                try:
-                    if message.get('image'):
-                        send_image_to_user(
-                            BOT_TOKEN,
-                            message['user'],
-                            message['text'],
-                            message['image']
-                        )
-                    else:
-                        send_message_to_user(
-                            BOT_TOKEN,
-                            message['user'],
-                            message['text']
-                        )
-                except Exception as e:
-                    logger.error(f"Error sending notification: {e}")
-                    # Try sending as text if image fails
-                    if message.get('image'):
-                        send_message_to_user(
-                            BOT_TOKEN,
-                            message['user'],
-                            message['text']
-                        )
-                        
-            except Exception as e:
-                logger.error(f"Error processing message for user {message['user']}: {e}")
-                continue
+        if not isinstance(data, (list, dict)):
+            logger.error("Invalid request: Unexpected payload type")
+            return jsonify({"error": "Invalid request"}), 400
+
+        queue_id = webhook_queue.enqueue(data)
+        logger.info(f"Queued webhook payload {queue_id}")
 
-        logger.info('Webhook processed successfully')
         return jsonify({
-            "status": "ok",
-            "messages_sent": len(messages)
+            "status": "queued",
+            "queue_id": str(queue_id)
         }), 200
 
     except Exception as e:
@@ -520,6 +1081,26 @@ if __name__ == '__main__':
     if missing_vars:
         raise EnvironmentError(f"Missing required environment variables: {', '.join(missing_vars)}")
     
+    # Make sure the collections have the indexes our queries rely on
+    ensure_indexes(db)
+    deduplicator.ensure_indexes()
+    token_store.ensure_indexes()
+
+    # Start with the busiest mints in memory instead of asking Helius for all of them again
+    token_cache.warm_up(int(os.environ.get('TOKEN_WARM_UP_SIZE', 1000)))
+
+    # Fork image workers before the sender and webhook threads start. The
+    # MongoClient's monitor threads already run, but the workers only ever
+    # call resize_image and never touch anything inherited from them
+    image_processor.start()
+
+    # Load watched wallets, then start background workers draining the webhook queue
+    address_index.start()
+    message_log.start()
+    dispatcher.start()
+    outbox.start(dispatch_notification)
+    webhook_queue.start()
+
     # Start Flask app
     logger.info(f"Starting server on port {port}")
     app.run(
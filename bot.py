@@ -1,6 +1,5 @@
 import logging
 import os
-import requests
 import base58
 import threading
 from http.server import HTTPServer, BaseHTTPRequestHandler
@@ -16,6 +15,8 @@ from telegram.error import BadRequest, Unauthorized, TimedOut
 from pymongo import MongoClient
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from utils.helius import HeliusClient
+from utils.schema import ensure_indexes
 
 # Load environment variables
 load_dotenv()
@@ -248,6 +249,9 @@ except Exception as e:
     logger.error(f"Failed to connect to MongoDB: {e}")
     raise
 
+# Pooled Helius client for webhook management
+helius = HeliusClient(HELIUS_KEY)
+
 # Utility functions
 def is_solana_wallet_address(address: str) -> bool:
     try:
@@ -259,8 +263,7 @@ def is_solana_wallet_address(address: str) -> bool:
 
 def get_webhook(webhook_id: str):
     try:
-        url = f"https://api.helius.xyz/v0/webhooks?api-key={HELIUS_KEY}"
-        response = requests.get(url, timeout=10)
+        response = helius.get_webhooks()
         
         if response.status_code != 200:
             logger.error(f"Helius API error: {response.status_code}")
@@ -281,9 +284,7 @@ def add_webhook(user_id: str, address: str, webhook_id: str, existing_addresses:
     try:
         if address in existing_addresses:
             return True
-            
-        url = f"https://api.helius.xyz/v0/webhooks/{webhook_id}?api-key={HELIUS_KEY}"
-        
+
         webhook_url = os.environ.get('WEBHOOK_URL')
         if not webhook_url:
             logger.warning("WEBHOOK_URL not set")
@@ -295,7 +296,7 @@ def add_webhook(user_id: str, address: str, webhook_id: str, existing_addresses:
             "webhookURL": webhook_url
         }
         
-        response = requests.put(url, json=data, timeout=10)
+        response = helius.update_webhook(webhook_id, data)
         return True
         
     except Exception as e:
@@ -671,6 +672,9 @@ def main() -> None:
         if missing_vars:
             raise EnvironmentError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
+        # Make sure the collections have the indexes our queries rely on
+        ensure_indexes(db)
+
         # Initialize bot
         updater = Updater(BOT_TOKEN)
         dispatcher = updater.dispatcher
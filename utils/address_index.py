@@ -0,0 +1,230 @@
+from datetime import datetime
+import logging
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Server error codes meaning change streams can't be used or resumed
+CHANGE_STREAMS_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = 286
+
+class AddressIndex:
+    """In-memory index of active wallets: address -> [(user_id, wallet name)].
+
+    Matching a transaction becomes a dictionary lookup per account instead of
+    a Mongo query. The index follows ``wallets`` through a change stream and
+    stores the resume token in ``index_state`` so a restart picks up where it
+    left off; an ``invalidate`` event (the collection was dropped or renamed)
+    starts a fresh stream and reloads. When change streams aren't available (standalone mongod) it
+    falls back to a full reload every ``refresh_interval`` seconds. If the
+    index hasn't been synced for ``max_staleness`` seconds, ``match`` queries
+    Mongo directly.
+    """
+
+    STATE_ID = "wallets_address_index"
+
+    def __init__(self, db, refresh_interval: int = 60, max_staleness: int = 300):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.max_staleness = max_staleness
+        self._by_address: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+        self._by_id: Dict = {}
+        self._last_sync: Optional[float] = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.mode = "polling"
+        self.lookups = 0
+        self.fallbacks = 0
+        self.changes_applied = 0
+
+    def load(self) -> bool:
+        try:
+            by_address: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+            by_id = {}
+            for doc in self.db.wallets.find(
+                {"status": "active"},
+                {"_id": 1, "user_id": 1, "address": 1, "name": 1}
+            ):
+                entry = (doc["user_id"], doc.get("name"))
+                by_address.setdefault(doc["address"], []).append(entry)
+                by_id[doc["_id"]] = (doc["address"], entry)
+
+            with self._lock:
+                self._by_address = by_address
+                self._by_id = by_id
+                self._last_sync = time.monotonic()
+            logger.info(f"Loaded {len(by_address)} watched addresses into the index")
+            return True
+        except Exception as e:
+            logger.error(f"Error loading watched address index: {e}")
+            return False
+
+    def _remove(self, doc_id) -> None:
+        # Caller holds the lock
+        address, entry = self._by_id.pop(doc_id, (None, None))
+        if address is None:
+            return
+        entries = self._by_address.get(address, [])
+        if entry in entries:
+            entries.remove(entry)
+        if not entries:
+            self._by_address.pop(address, None)
+
+    def apply_change(self, change: Dict) -> None:
+        """Apply one change stream event from ``wallets`` to the index"""
+        if "documentKey" not in change:
+            # drop/rename/invalidate aren't about one wallet, the invalidate that follows reloads
+            return
+        doc_id = change["documentKey"]["_id"]
+        doc = change.get("fullDocument")
+        with self._lock:
+            self._remove(doc_id)
+            if change["operationType"] != "delete" and doc and doc.get("status") == "active":
+                entry = (doc["user_id"], doc.get("name"))
+                self._by_address.setdefault(doc["address"], []).append(entry)
+                self._by_id[doc_id] = (doc["address"], entry)
+            self._last_sync = time.monotonic()
+            self.changes_applied += 1
+
+    def _load_resume_token(self):
+        try:
+            state = self.db.index_state.find_one({"_id": self.STATE_ID})
+            return state.get("resume_token") if state else None
+        except Exception as e:
+            logger.error(f"Error loading address index resume token: {e}")
+            return None
+
+    def _save_resume_token(self, token) -> None:
+        try:
+            self.db.index_state.update_one(
+                {"_id": self.STATE_ID},
+                {"$set": {"resume_token": token, "updated_at": datetime.now()}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Error saving address index resume token: {e}")
+
+    def _open_stream(self, resume_token):
+        return self.db.wallets.watch(
+            full_document="updateLookup",
+            resume_after=resume_token,
+            max_await_time_ms=1000
+        )
+
+    def _watch(self) -> None:
+        """Follow the change stream until it fails or the index is stopped"""
+        with self._open_stream(self._load_resume_token()) as stream:
+            # The stream is open, so a snapshot taken now can't miss a change
+            self.load()
+            self.mode = "change_stream"
+            logger.info("Following wallet changes through a change stream")
+            while not self._stopping.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    if change["operationType"] == "invalidate":
+                        # The stream can't be resumed past this, start over from a fresh snapshot
+                        logger.warning("Address index change stream invalidated, reopening")
+                        self._save_resume_token(None)
+                        return
+                    self.apply_change(change)
+                    self._save_resume_token(stream.resume_token)
+                else:
+                    with self._lock:
+                        self._last_sync = time.monotonic()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self._watch()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    break
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    logger.warning("Address index resume token expired, starting a fresh change stream")
+                    self._save_resume_token(None)
+                    continue
+                logger.error(f"Address index change stream failed, reconnecting: {e}")
+                self._stopping.wait(5)
+            except PyMongoError as e:
+                logger.error(f"Address index change stream failed, reconnecting: {e}")
+                self._stopping.wait(5)
+            except Exception as e:
+                # Never let a bad event end the thread, the index would silently go stale
+                logger.error(f"Unexpected error following wallet changes, reconnecting: {e}")
+                self._stopping.wait(5)
+
+        if self._stopping.is_set():
+            return
+
+        self.mode = "polling"
+        logger.warning("Change streams unavailable, resyncing the address index periodically")
+        while not self._stopping.wait(self.refresh_interval):
+            self.load()
+
+    def is_stale(self) -> bool:
+        with self._lock:
+            return self._last_sync is None or time.monotonic() - self._last_sync > self.max_staleness
+
+    def match(self, accounts: Iterable[str]) -> List[Dict]:
+        """Return wallet docs (user_id, address, name) watching any of ``accounts``"""
+        accounts = set(accounts)
+        if self.is_stale():
+            with self._lock:
+                self.fallbacks += 1
+            logger.warning("Watched address index is stale, querying MongoDB")
+            return list(self.db.wallets.find({
+                "address": {"$in": list(accounts)},
+                "status": "active"
+            }))
+
+        docs = []
+        with self._lock:
+            self.lookups += 1
+            for address in accounts & self._by_address.keys():
+                for user_id, name in self._by_address[address]:
+                    doc = {"user_id": user_id, "address": address}
+                    if name is not None:
+                        doc["name"] = name
+                    docs.append(doc)
+        return docs
+
+    def start(self) -> None:
+        self.load()
+        self._thread = threading.Thread(target=self._run, name="address-index", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the index structures in bytes"""
+        with self._lock:
+            size = sys.getsizeof(self._by_address) + sys.getsizeof(self._by_id)
+            for address, entries in self._by_address.items():
+                size += sys.getsizeof(address) + sys.getsizeof(entries)
+                for entry in entries:
+                    size += sys.getsizeof(entry) + sum(sys.getsizeof(value) for value in entry)
+            for doc_id, value in self._by_id.items():
+                size += sys.getsizeof(doc_id) + sys.getsizeof(value)
+            return size
+
+    def stats(self) -> Dict:
+        memory = self.memory_bytes()
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "addresses": len(self._by_address),
+                "wallets": len(self._by_id),
+                "memory_bytes": memory,
+                "last_sync_age_seconds": time.monotonic() - self._last_sync if self._last_sync else None,
+                "lookups": self.lookups,
+                "fallbacks": self.fallbacks,
+                "changes_applied": self.changes_applied
+            }
@@ -0,0 +1,97 @@
+from collections import deque
+import logging
+import threading
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+class CircuitState:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+class CircuitOpen(Exception):
+    """The endpoint's circuit is open, the call was not made"""
+
+class CircuitBreaker:
+    """Stops calling an endpoint that keeps failing or answering too slowly.
+
+    The last ``window`` calls are kept; once at least ``min_calls`` of them
+    are in and ``failure_rate`` of them failed or took ``slow_call_seconds``
+    or longer, the circuit opens and ``allow`` refuses calls for
+    ``open_seconds``. After that a single probe call is let through
+    (half-open): if it succeeds the circuit closes again, otherwise it
+    reopens. Every transition is logged and counted.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 10,
+                 window: int = 20, slow_call_seconds: float = 5.0, open_seconds: float = 30.0):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.state = CircuitState.CLOSED
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.transitions: Dict[str, int] = {}
+        self.short_circuited = 0
+
+    def _transition(self, state: str) -> None:
+        # Caller holds the lock
+        previous, self.state = self.state, state
+        key = f"{previous}_to_{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+            logger.warning(f"Circuit for {self.name} opened ({previous} -> {state}), pausing calls for {self.open_seconds}s")
+        else:
+            logger.info(f"Circuit for {self.name} {previous} -> {state}")
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; the caller must ``record`` its outcome if so"""
+        with self._lock:
+            if self.state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._transition(CircuitState.HALF_OPEN)
+            if self.state == CircuitState.CLOSED:
+                return True
+            if self.state == CircuitState.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record(self, success: bool, duration: float) -> None:
+        failed = not success or duration >= self.slow_call_seconds
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN:
+                self._probing = False
+                self._outcomes.clear()
+                self._transition(CircuitState.OPEN if failed else CircuitState.CLOSED)
+                return
+            if self.state == CircuitState.OPEN:
+                # A call that started before the circuit opened
+                return
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls and \
+                    sum(self._outcomes) / len(self._outcomes) >= self.failure_rate:
+                self._outcomes.clear()
+                self._transition(CircuitState.OPEN)
+
+    def cancel(self) -> None:
+        """Give up an allowed call without an outcome that says anything about the endpoint"""
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN:
+                self._probing = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "recent_failure_rate": sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0,
+                "short_circuited": self.short_circuited,
+                "transitions": dict(self.transitions)
+            }
@@ -0,0 +1,55 @@
+import threading
+import time
+from typing import Dict, Optional
+
+class DeadlineExceeded(Exception):
+    """The time budget ran out before the call was made"""
+
+class Deadline:
+    """Time budget for one piece of work, passed down to every call it makes"""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def clamp(self, timeout: float) -> float:
+        """``timeout`` shortened so it ends no later than the deadline"""
+        return min(timeout, self.remaining())
+
+class StageStats:
+    """How often each optional enrichment stage ran or was skipped for lack of time"""
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, skipped: bool, count: int = 1) -> None:
+        with self._lock:
+            counts = self._counts.setdefault(stage, {"ran": 0, "skipped": 0})
+            counts["skipped" if skipped else "ran"] += count
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                stage: dict(
+                    counts,
+                    skip_rate=counts["skipped"] / (counts["ran"] + counts["skipped"])
+                    if counts["ran"] + counts["skipped"] else 0.0
+                )
+                for stage, counts in self._counts.items()
+            }
+
+def clamp_timeout(timeout, deadline: Optional[Deadline]):
+    """Clamp a requests-style timeout (a number or a (connect, read) tuple) to ``deadline``"""
+    if deadline is None:
+        return timeout
+    # requests rejects a zero timeout, so leave a sliver
+    if isinstance(timeout, tuple):
+        return tuple(max(deadline.clamp(value), 0.01) for value in timeout)
+    return max(deadline.clamp(timeout), 0.01)
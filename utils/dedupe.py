@@ -0,0 +1,119 @@
+from datetime import datetime
+import logging
+import threading
+from typing import Dict, Iterable, Set
+from cachetools import TTLCache
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+class SignatureDeduplicator:
+    """Drops transactions whose signature was already processed.
+
+    Recent signatures are kept in memory; the ``processed_signatures``
+    collection (unique on ``signature``, expiring after ``ttl`` seconds) makes
+    the check hold across restarts and between webhook processes. A claim
+    can name its ``owner`` (the webhook queue item); when that same item is
+    processed again, e.g. after its worker died mid-way, its own signatures
+    count as fresh instead of duplicates. If Mongo can't be reached the check
+    fails open so notifications still go out.
+    """
+
+    def __init__(self, db, window_size: int = 100000, window_ttl: int = 3600, ttl: int = 86400):
+        self.collection = db.processed_signatures
+        self.ttl = ttl
+        self._recent = TTLCache(maxsize=window_size, ttl=window_ttl)
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.memory_duplicates = 0
+        self.store_duplicates = 0
+        self.reclaimed = 0
+
+    def ensure_indexes(self) -> None:
+        try:
+            self.collection.create_index("signature", unique=True, background=True)
+            self.collection.create_index("created_at", expireAfterSeconds=self.ttl, background=True)
+        except Exception as e:
+            logger.error(f"Error creating processed signature indexes: {e}")
+
+    def claim_many(self, signatures: Iterable[str], owner=None) -> Set[str]:
+        """Record ``signatures`` as processed by ``owner`` and return the ones
+        seen for the first time or already claimed by the same ``owner``"""
+        candidates = []
+        with self._lock:
+            for signature in signatures:
+                claimed_by = self._recent.get(signature)
+                if signature in candidates or (
+                    claimed_by is not None and (owner is None or claimed_by != owner)
+                ):
+                    self.memory_duplicates += 1
+                else:
+                    candidates.append(signature)
+
+        if not candidates:
+            return set()
+
+        now = datetime.now()
+        duplicates = set()
+        try:
+            self.collection.insert_many(
+                [{"signature": signature, "owner": owner, "created_at": now} for signature in candidates],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") == DUPLICATE_KEY_ERROR:
+                    duplicates.add(candidates[error["index"]])
+                else:
+                    logger.error(f"Error recording signature {candidates[error['index']]}: {error.get('errmsg')}")
+        except Exception as e:
+            logger.error(f"Error recording processed signatures: {e}")
+
+        reclaimed = set()
+        if duplicates and owner is not None:
+            try:
+                reclaimed = set(
+                    doc["signature"] for doc in self.collection.find(
+                        {"signature": {"$in": list(duplicates)}, "owner": owner},
+                        {"_id": 0, "signature": 1}
+                    )
+                )
+            except Exception as e:
+                logger.error(f"Error checking reclaimed signatures: {e}")
+            duplicates -= reclaimed
+
+        with self._lock:
+            for signature in candidates:
+                self._recent[signature] = owner if owner is not None else True
+            self.reclaimed += len(reclaimed)
+            self.store_duplicates += len(duplicates)
+            self.accepted += len(candidates) - len(duplicates)
+
+        return set(candidates) - duplicates
+
+    def release(self, signatures: Iterable[str]) -> None:
+        """Forget ``signatures`` so a redelivery is processed again, e.g. after a failure"""
+        signatures = list(signatures)
+        if not signatures:
+            return
+        with self._lock:
+            for signature in signatures:
+                self._recent.pop(signature, None)
+            self.accepted -= len(signatures)
+        try:
+            self.collection.delete_many({"signature": {"$in": signatures}})
+        except Exception as e:
+            logger.error(f"Error releasing processed signatures: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "accepted": self.accepted,
+                "duplicates": self.memory_duplicates + self.store_duplicates,
+                "memory_duplicates": self.memory_duplicates,
+                "store_duplicates": self.store_duplicates,
+                "reclaimed": self.reclaimed,
+                "window_size": len(self._recent)
+            }
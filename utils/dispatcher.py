@@ -0,0 +1,204 @@
+from collections import deque
+import heapq
+import logging
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+from utils.metrics import LatencyHistogram
+from utils.rate_limiter import SendGovernor
+
+logger = logging.getLogger(__name__)
+
+class Lane:
+    PRIORITY = "priority"
+    STANDARD = "standard"
+
+class NotificationDispatcher:
+    """Runs send jobs on a pool of workers with a priority and a standard lane.
+
+    Workers take up to ``priority_weight`` jobs from the priority lane for
+    every standard job while both have work, so premium notifications go
+    first without starving free users. ``submit`` blocks once ``max_pending``
+    jobs are waiting, which pushes back on the webhook workers.
+
+    Jobs submitted with a ``chat_id`` run one at a time per chat, and with a
+    ``governor`` only once the chat's rate-limit bucket has refilled. Until
+    then they are parked per chat, so workers keep sending to other chats
+    instead of sleeping on a busy one.
+    """
+
+    def __init__(self, workers: int = 8, priority_weight: int = 3, max_pending: int = 10000,
+                 governor: Optional[SendGovernor] = None):
+        self.workers = workers
+        self.priority_weight = priority_weight
+        self.max_pending = max_pending
+        self.governor = governor
+        self._lanes: Dict[str, Deque[Tuple[Callable[[], None], float, Optional[str]]]] = {
+            Lane.PRIORITY: deque(),
+            Lane.STANDARD: deque()
+        }
+        # Chats' held-back jobs in order, and when each chat is next worth checking
+        self._parked: Dict[str, Deque[Tuple[str, Callable[[], None], float]]] = {}
+        self._ready: List[Tuple[float, str]] = []
+        self._in_flight: Set[str] = set()
+        self.parked_total = 0
+        self._condition = threading.Condition()
+        self._priority_streak = 0
+        self._stopping = False
+        self._threads: List[threading.Thread] = []
+        self._latency = {lane: LatencyHistogram() for lane in self._lanes}
+        self._wait = {lane: LatencyHistogram() for lane in self._lanes}
+        self._completed = {lane: 0 for lane in self._lanes}
+        self._failed = {lane: 0 for lane in self._lanes}
+        self._stats_lock = threading.Lock()
+
+    def pending(self) -> int:
+        return sum(len(jobs) for jobs in self._lanes.values()) + \
+            sum(len(jobs) for jobs in self._parked.values())
+
+    def submit(self, job: Callable[[], None], priority: bool = False,
+               chat_id: Optional[str] = None, block: bool = True) -> None:
+        """Queue ``job``; ``block=False`` skips the ``max_pending`` wait, for jobs
+        submitted from inside a worker, which would otherwise wait on itself"""
+        lane = Lane.PRIORITY if priority else Lane.STANDARD
+        with self._condition:
+            while block and self.pending() >= self.max_pending and not self._stopping:
+                self._condition.wait()
+            self._lanes[lane].append((job, time.monotonic(), chat_id))
+            self._condition.notify_all()
+
+    def _chat_wait(self, chat_id: str) -> float:
+        return self.governor.chat_wait(chat_id) if self.governor else 0.0
+
+    def _park(self, chat_id: str, lane: str, job: Callable[[], None], enqueued_at: float, wait: float) -> None:
+        # Caller holds the condition
+        parked = self._parked.setdefault(chat_id, deque())
+        parked.append((lane, job, enqueued_at))
+        self.parked_total += 1
+        # A chat already parked is scheduled; one in flight is scheduled when it finishes
+        if len(parked) == 1 and chat_id not in self._in_flight:
+            heapq.heappush(self._ready, (time.monotonic() + wait, chat_id))
+
+    def _pop_lane(self):
+        # Caller holds the condition
+        priority_jobs = self._lanes[Lane.PRIORITY]
+        standard_jobs = self._lanes[Lane.STANDARD]
+        if priority_jobs and (not standard_jobs or self._priority_streak < self.priority_weight):
+            self._priority_streak += 1
+            return Lane.PRIORITY, priority_jobs.popleft()
+        self._priority_streak = 0
+        return Lane.STANDARD, standard_jobs.popleft()
+
+    def _next_job(self):
+        """The next job allowed to run as ``(lane, job, enqueued_at, chat_id)``, or None"""
+        # Caller holds the condition
+        now = time.monotonic()
+        while self._ready and self._ready[0][0] <= now:
+            _, chat_id = heapq.heappop(self._ready)
+            if chat_id in self._in_flight or not self._parked.get(chat_id):
+                continue
+            wait = self._chat_wait(chat_id)
+            if wait > 0:
+                heapq.heappush(self._ready, (now + wait, chat_id))
+                continue
+            lane, job, enqueued_at = self._parked[chat_id].popleft()
+            if not self._parked[chat_id]:
+                del self._parked[chat_id]
+            return lane, job, enqueued_at, chat_id
+
+        while any(self._lanes.values()):
+            lane, (job, enqueued_at, chat_id) = self._pop_lane()
+            if chat_id is None:
+                return lane, job, enqueued_at, None
+            if chat_id in self._in_flight or chat_id in self._parked:
+                self._park(chat_id, lane, job, enqueued_at, 0.0)
+                continue
+            wait = self._chat_wait(chat_id)
+            if wait > 0:
+                self._park(chat_id, lane, job, enqueued_at, wait)
+                continue
+            return lane, job, enqueued_at, chat_id
+        return None
+
+    def _finish_chat(self, chat_id: str) -> None:
+        # Caller holds the condition
+        self._in_flight.discard(chat_id)
+        if self._parked.get(chat_id):
+            heapq.heappush(self._ready, (time.monotonic() + self._chat_wait(chat_id), chat_id))
+
+    def _worker_loop(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    picked = self._next_job()
+                    if picked is not None:
+                        break
+                    if self._stopping and not self.pending():
+                        return
+                    # Sleep until new work arrives or the earliest parked chat is due
+                    timeout = max(self._ready[0][0] - time.monotonic(), 0.01) if self._ready else None
+                    self._condition.wait(timeout)
+                lane, job, enqueued_at, chat_id = picked
+                if chat_id is not None:
+                    self._in_flight.add(chat_id)
+                self._condition.notify_all()
+
+            self._wait[lane].observe(time.monotonic() - enqueued_at)
+            try:
+                job()
+                failed = False
+            except Exception as e:
+                failed = True
+                logger.error(f"Notification job failed in {lane} lane: {e}")
+            if chat_id is not None:
+                with self._condition:
+                    self._finish_chat(chat_id)
+                    self._condition.notify_all()
+            with self._stats_lock:
+                if failed:
+                    self._failed[lane] += 1
+                else:
+                    self._completed[lane] += 1
+            self._latency[lane].observe(time.monotonic() - enqueued_at)
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"notifier-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} notification workers")
+
+    def stop(self) -> None:
+        """Let workers drain the queued jobs, then stop them"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=10)
+        self._threads = []
+
+    def stats(self) -> Dict:
+        with self._condition:
+            depths = {lane: len(jobs) for lane, jobs in self._lanes.items()}
+            parked = sum(len(jobs) for jobs in self._parked.values())
+            parked_chats = len(self._parked)
+            parked_total = self.parked_total
+        with self._stats_lock:
+            completed = dict(self._completed)
+            failed = dict(self._failed)
+        return {
+            "workers": len(self._threads),
+            "parked": parked,
+            "parked_chats": parked_chats,
+            "parked_total": parked_total,
+            "lanes": {
+                lane: {
+                    "depth": depths[lane],
+                    "completed": completed[lane],
+                    "failed": failed[lane],
+                    "queue_wait": self._wait[lane].snapshot(),
+                    "send_latency": self._latency[lane].snapshot()
+                }
+                for lane in self._lanes
+            }
+        }
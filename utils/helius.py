@@ -0,0 +1,251 @@
+from contextlib import contextmanager
+import logging
+import random
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+from cachetools import LRUCache
+import requests
+from requests.adapters import HTTPAdapter
+from utils.circuit_breaker import CircuitBreaker, CircuitOpen, CircuitState
+from utils.deadline import Deadline, DeadlineExceeded, clamp_timeout
+from utils.host_limiter import HostLimiter
+from utils.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.helius.xyz"
+RPC_URL = "https://rpc.helius.xyz"
+
+# (connect, read) timeouts per endpoint
+DEFAULT_TIMEOUTS: Dict[str, Tuple[float, float]] = {
+    "token_metadata": (3.05, 10),
+    "rpc": (3.05, 10),
+    "offchain_metadata": (3.05, 8),
+    "webhooks": (3.05, 15)
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Endpoints that call arbitrary hosts, so each host gets its own breaker
+PER_HOST_BREAKER_ENDPOINTS = {"offchain_metadata"}
+
+class EndpointStats:
+    def __init__(self, breaker: Optional[CircuitBreaker]):
+        self.breaker = breaker
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.statuses: Dict[int, int] = {}
+
+class HeliusClient:
+    """Helius API client shared by the webhook service and the bot.
+
+    Requests go through one keep-alive ``requests.Session`` with a pool of
+    ``pool_size`` connections per host, so calls reuse warm TLS connections.
+    Each endpoint has its own timeout. Connection errors, timeouts, 429s and
+    5xx responses are retried up to ``max_retries`` times with jittered
+    exponential backoff (honouring ``Retry-After``). Latency, retries and
+    errors are tracked per endpoint. With a ``deadline`` the timeouts shrink
+    to the time left, retries stop once their backoff wouldn't fit, and an
+    expired deadline raises DeadlineExceeded without sending anything.
+    A deadline-clamped timeout still counts against the breaker once it ran
+    for ``slow_call_seconds``, so keep that below the deadline budget.
+    Each endpoint also has a CircuitBreaker: while it's open calls raise
+    CircuitOpen immediately, and callers fall back to cached or empty data.
+    Off-chain metadata lives on many unrelated hosts, so that endpoint has a
+    breaker per host (the ``max_host_breakers`` most recent) instead, and
+    one dead gateway can't cut off the others.
+    A ``host_limiter`` caps concurrent requests per host when callers fan out.
+    """
+
+    def __init__(self, api_key: str, pool_size: int = 10, max_retries: int = 2,
+                 base_delay: float = 0.5, max_delay: float = 8.0,
+                 timeouts: Optional[Dict[str, Tuple[float, float]]] = None,
+                 breaker_options: Optional[Dict] = None,
+                 host_limiter: Optional[HostLimiter] = None,
+                 max_host_breakers: int = 1000):
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.breaker_options = breaker_options or {}
+        self.host_limiter = host_limiter
+        self._stats: Dict[str, EndpointStats] = {}
+        self._host_breakers = LRUCache(maxsize=max_host_breakers)
+        self._lock = threading.Lock()
+
+    def _endpoint_stats(self, endpoint: str) -> EndpointStats:
+        # Caller holds the lock
+        stats = self._stats.get(endpoint)
+        if stats is None:
+            stats = self._stats[endpoint] = EndpointStats(
+                None if endpoint in PER_HOST_BREAKER_ENDPOINTS
+                else CircuitBreaker(f"Helius {endpoint}", **self.breaker_options)
+            )
+        return stats
+
+    def _breaker(self, endpoint: str, url: str) -> CircuitBreaker:
+        # Caller holds the lock
+        if endpoint not in PER_HOST_BREAKER_ENDPOINTS:
+            return self._endpoint_stats(endpoint).breaker
+        key = (endpoint, urlparse(url).hostname or '')
+        breaker = self._host_breakers.get(key)
+        if breaker is None:
+            breaker = self._host_breakers[key] = CircuitBreaker(
+                f"{endpoint} on {key[1]}", **self.breaker_options
+            )
+        return breaker
+
+    def _delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.max_delay)
+        delay = min(self.base_delay * 2 ** attempt, self.max_delay)
+        return delay * random.uniform(0.5, 1.5)
+
+    @contextmanager
+    def _host_slot(self, url: str, endpoint: str, deadline: Optional[Deadline]) -> Iterator[None]:
+        """Hold one of the host's connection slots when a ``host_limiter`` is set"""
+        if self.host_limiter is None:
+            yield
+            return
+        host = urlparse(url).hostname or ''
+        if not self.host_limiter.acquire(host, deadline.remaining() if deadline is not None else None):
+            raise DeadlineExceeded(f"No time left waiting for a Helius {endpoint} connection")
+        try:
+            yield
+        finally:
+            self.host_limiter.release(host)
+
+    def request(self, endpoint: str, method: str, url: str,
+                deadline: Optional[Deadline] = None, **kwargs) -> requests.Response:
+        """Send a request, retrying transient failures; raises once retries run out"""
+        timeout = self.timeouts.get(endpoint, (3.05, 10))
+        with self._lock:
+            breaker = self._breaker(endpoint, url)
+        attempt = 0
+        while True:
+            if deadline is not None and deadline.expired():
+                raise DeadlineExceeded(f"No time left for Helius {endpoint} request")
+            with self._host_slot(url, endpoint, deadline):
+                if not breaker.allow():
+                    raise CircuitOpen(f"{breaker.name} circuit is open")
+                started = time.monotonic()
+                response = None
+                error = None
+                request_timeout = clamp_timeout(timeout, deadline)
+                try:
+                    response = self.session.request(method, url, timeout=request_timeout, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                except Exception:
+                    breaker.record(False, time.monotonic() - started)
+                    raise
+
+                retryable = error is not None or response.status_code in RETRY_STATUSES
+                elapsed = time.monotonic() - started
+                if isinstance(error, requests.Timeout) and request_timeout != timeout \
+                        and elapsed < breaker.slow_call_seconds:
+                    # Our deadline cut the call short before it counted as slow,
+                    # which says nothing about the endpoint
+                    breaker.cancel()
+                else:
+                    breaker.record(not retryable, elapsed)
+            with self._lock:
+                stats = self._endpoint_stats(endpoint)
+                stats.requests += 1
+                stats.latency.observe(time.monotonic() - started)
+                if response is not None:
+                    stats.statuses[response.status_code] = stats.statuses.get(response.status_code, 0) + 1
+                if retryable or response.status_code >= 400:
+                    stats.errors += 1
+
+            delay = self._delay(attempt, response)
+            out_of_time = deadline is not None and delay >= deadline.remaining()
+            if not retryable or attempt >= self.max_retries or out_of_time:
+                if error is not None:
+                    raise error
+                return response
+
+            with self._lock:
+                self._endpoint_stats(endpoint).retries += 1
+            logger.warning(
+                f"Helius {endpoint} request failed ({error or response.status_code}), "
+                f"retrying in {delay:.1f}s"
+            )
+            time.sleep(delay)
+            attempt += 1
+
+    def token_metadata(self, mints: List[str], include_off_chain: bool = False,
+                       deadline: Optional[Deadline] = None) -> requests.Response:
+        payload = {"mintAccounts": mints}
+        if include_off_chain:
+            payload.update(includeOffChain=True, disableCache=False)
+        return self.request(
+            "token_metadata", "POST", f"{API_URL}/v0/token-metadata",
+            params={"api-key": self.api_key}, json=payload, deadline=deadline
+        )
+
+    def get_asset(self, asset_id: str, deadline: Optional[Deadline] = None) -> requests.Response:
+        return self.request(
+            "rpc", "POST", f"{RPC_URL}/",
+            params={"api-key": self.api_key},
+            json={"jsonrpc": "2.0", "id": "my-id", "method": "getAsset", "params": [asset_id]},
+            deadline=deadline
+        )
+
+    def offchain_metadata(self, url: str, deadline: Optional[Deadline] = None) -> requests.Response:
+        """Fetch an asset's off-chain JSON (usually Arweave/IPFS, not Helius itself)"""
+        return self.request("offchain_metadata", "GET", url, deadline=deadline)
+
+    def get_webhooks(self) -> requests.Response:
+        return self.request(
+            "webhooks", "GET", f"{API_URL}/v0/webhooks",
+            params={"api-key": self.api_key}
+        )
+
+    def update_webhook(self, webhook_id: str, data: Dict) -> requests.Response:
+        return self.request(
+            "webhooks", "PUT", f"{API_URL}/v0/webhooks/{webhook_id}",
+            params={"api-key": self.api_key}, json=data
+        )
+
+    def _circuit_stats(self, endpoint: str, stats: EndpointStats) -> Dict:
+        # Caller holds the lock
+        if stats.breaker is not None:
+            return stats.breaker.stats()
+        # Only the hosts whose circuit isn't closed, there can be many
+        breakers = [
+            (host, breaker) for (name, host), breaker in self._host_breakers.items()
+            if name == endpoint
+        ]
+        return {
+            "hosts": len(breakers),
+            "not_closed": {
+                host: breaker.stats() for host, breaker in breakers
+                if breaker.state != CircuitState.CLOSED
+            }
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                endpoint: {
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "retries": stats.retries,
+                    "statuses": {str(status): count for status, count in stats.statuses.items()},
+                    "latency": stats.latency.snapshot(),
+                    "circuit": self._circuit_stats(endpoint, stats)
+                }
+                for endpoint, stats in self._stats.items()
+            }
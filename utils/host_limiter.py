@@ -0,0 +1,53 @@
+import threading
+import time
+from typing import Dict, Optional
+
+class HostLimiter:
+    """Caps how many requests run against the same host at once.
+
+    Enrichment fans out across threads, so without a cap one slow host could
+    take every worker. ``acquire`` waits for one of the host's ``per_host``
+    slots; every successful ``acquire`` must be paired with ``release``.
+    """
+
+    def __init__(self, per_host: int = 4):
+        self.per_host = per_host
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return semaphore
+
+    def acquire(self, host: str, timeout: Optional[float] = None) -> bool:
+        """Take one of ``host``'s slots; False if none freed up within ``timeout``"""
+        semaphore = self._semaphore(host)
+        if semaphore.acquire(blocking=False):
+            return True
+        started = time.monotonic()
+        acquired = semaphore.acquire(timeout=timeout) if timeout is not None else semaphore.acquire()
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds += time.monotonic() - started
+        return acquired
+
+    def release(self, host: str) -> None:
+        self._semaphore(host).release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "per_host": self.per_host,
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+                "in_use": {
+                    host: self.per_host - semaphore._value
+                    for host, semaphore in self._semaphores.items()
+                    if semaphore._value < self.per_host
+                }
+            }
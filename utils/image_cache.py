@@ -0,0 +1,132 @@
+from collections import OrderedDict
+import logging
+import threading
+from typing import Callable, Dict, Optional
+from cachetools import LRUCache, TTLCache
+
+logger = logging.getLogger(__name__)
+
+class ImageUnavailable(Exception):
+    """Loading this image failed recently, so it isn't tried again yet"""
+
+class ImageCache:
+    """Processed NFT images and their Telegram file_ids, keyed by image URL.
+
+    Once Telegram has stored an image we resend it by ``file_id`` and no bytes
+    are transferred at all. Until then the resized JPEG is kept in an LRU
+    bounded by ``max_bytes``, and concurrent recipients of the same image
+    wait for a single download instead of each processing it. A failed load
+    (too large, timed out, broken URL) is remembered for ``failure_ttl``
+    seconds, during which the image raises ImageUnavailable right away.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_file_ids: int = 50000,
+                 failure_ttl: int = 300, max_failures: int = 10000):
+        self.max_bytes = max_bytes
+        self._images: "OrderedDict[str, bytes]" = OrderedDict()
+        self._file_ids = LRUCache(maxsize=max_file_ids)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._failures = TTLCache(maxsize=max_failures, ttl=failure_ttl)
+        self.file_id_hits = 0
+        self.image_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.failure_hits = 0
+
+    def get_file_id(self, url: str) -> Optional[str]:
+        with self._lock:
+            file_id = self._file_ids.get(url)
+            if file_id is not None:
+                self.file_id_hits += 1
+            return file_id
+
+    def set_file_id(self, url: str, file_id: str) -> None:
+        with self._lock:
+            self._file_ids[url] = file_id
+            # Telegram has the image now, the bytes are no longer needed
+            data = self._images.pop(url, None)
+            if data is not None:
+                self._bytes -= len(data)
+
+    def forget_file_id(self, url: str) -> None:
+        with self._lock:
+            self._file_ids.pop(url, None)
+
+    def _get_image(self, url: str) -> Optional[bytes]:
+        # Caller holds the lock
+        data = self._images.get(url)
+        if data is not None:
+            self._images.move_to_end(url)
+        return data
+
+    def _put_image(self, url: str, data: bytes) -> None:
+        # Caller holds the lock
+        if len(data) > self.max_bytes:
+            return
+        old = self._images.pop(url, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._images[url] = data
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _check_failure(self, url: str) -> None:
+        # Caller holds the lock
+        error = self._failures.get(url)
+        if error is not None:
+            self.failure_hits += 1
+            raise ImageUnavailable(f"Loading {url} failed recently: {error}")
+
+    def get_or_load(self, url: str, load: Callable[[str], bytes]) -> bytes:
+        """Return the processed image for ``url``, calling ``load`` once on a miss"""
+        with self._lock:
+            data = self._get_image(url)
+            if data is not None:
+                self.image_hits += 1
+                return data
+            self._check_failure(url)
+            url_lock = self._loading.setdefault(url, threading.Lock())
+
+        with url_lock:
+            with self._lock:
+                data = self._get_image(url)
+                if data is not None:
+                    self.image_hits += 1
+                    return data
+                # Whoever held the lock before us may just have failed
+                self._check_failure(url)
+                self.misses += 1
+            try:
+                data = load(url)
+                with self._lock:
+                    self._put_image(url, data)
+                return data
+            except Exception as e:
+                with self._lock:
+                    self._failures[url] = str(e) or type(e).__name__
+                raise
+            finally:
+                with self._lock:
+                    self._loading.pop(url, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.file_id_hits + self.image_hits + self.misses
+            return {
+                "images": len(self._images),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "file_ids": len(self._file_ids),
+                "file_id_hits": self.file_id_hits,
+                "image_hits": self.image_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "failures": len(self._failures),
+                "failure_hits": self.failure_hits,
+                "hit_rate": (self.file_id_hits + self.image_hits) / lookups if lookups else 0.0
+            }
@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlparse
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+class DeliveryStrategy:
+    URL = "url"
+    UPLOAD = "upload"
+
+class HostRecord:
+    def __init__(self):
+        self.url_sent = 0
+        self.url_failed = 0
+        self.uploads = 0
+        self.skipped = 0
+
+    def url_success_rate(self) -> Optional[float]:
+        attempts = self.url_sent + self.url_failed
+        return self.url_sent / attempts if attempts else None
+
+class ImageDeliverySelector:
+    """Chooses between letting Telegram fetch an image URL and uploading it ourselves.
+
+    Passing the URL to ``send_photo`` skips our download and resize entirely,
+    so it is tried first for images on ``allowed_hosts`` whose extension (if
+    any) is in ``allowed_extensions``. Outcomes are tracked per host: once a
+    host has failed by URL at least ``min_attempts`` times with a success rate
+    under ``min_success_rate``, its images go straight to upload, with one in
+    every ``explore_every`` still tried by URL in case the host recovered.
+    """
+
+    def __init__(self, allowed_hosts: Iterable[str],
+                 allowed_extensions: Iterable[str] = ('.jpg', '.jpeg', '.png'),
+                 min_attempts: int = 5, min_success_rate: float = 0.5,
+                 explore_every: int = 20, max_hosts: int = 10000):
+        self.allowed_hosts = {host.strip().lower() for host in allowed_hosts if host.strip()}
+        self.allowed_extensions = {ext.lower() for ext in allowed_extensions}
+        self.min_attempts = min_attempts
+        self.min_success_rate = min_success_rate
+        self.explore_every = explore_every
+        self._hosts = LRUCache(maxsize=max_hosts)
+        self._lock = threading.Lock()
+        self.totals = {
+            "url_sent": 0,
+            "url_failed": 0,
+            "uploads": 0,
+            "not_eligible": 0
+        }
+
+    def _host_allowed(self, host: str) -> bool:
+        return any(host == allowed or host.endswith('.' + allowed) for allowed in self.allowed_hosts)
+
+    def _eligible(self, url: str) -> Optional[str]:
+        """The URL's host if Telegram may fetch it directly, else None"""
+        parsed = urlparse(url)
+        if parsed.scheme != 'https' or not parsed.hostname:
+            return None
+        host = parsed.hostname.lower()
+        if not self._host_allowed(host):
+            return None
+        extension = os.path.splitext(parsed.path)[1].lower()
+        # Gateways like Arweave serve images without an extension, so only a known-bad one disqualifies
+        if extension and extension not in self.allowed_extensions:
+            return None
+        return host
+
+    def _record(self, host: str) -> HostRecord:
+        # Caller holds the lock
+        record = self._hosts.get(host)
+        if record is None:
+            record = HostRecord()
+            self._hosts[host] = record
+        return record
+
+    def choose(self, url: str) -> str:
+        host = self._eligible(url)
+        with self._lock:
+            if host is None:
+                self.totals["not_eligible"] += 1
+                return DeliveryStrategy.UPLOAD
+            record = self._record(host)
+            rate = record.url_success_rate()
+            if record.url_failed >= self.min_attempts and rate is not None and rate < self.min_success_rate:
+                record.skipped += 1
+                if record.skipped % self.explore_every:
+                    return DeliveryStrategy.UPLOAD
+            return DeliveryStrategy.URL
+
+    def record(self, url: str, strategy: str, success: bool) -> None:
+        host = (urlparse(url).hostname or '').lower()
+        with self._lock:
+            record = self._record(host)
+            if strategy == DeliveryStrategy.URL:
+                if success:
+                    record.url_sent += 1
+                    self.totals["url_sent"] += 1
+                else:
+                    record.url_failed += 1
+                    self.totals["url_failed"] += 1
+            elif success:
+                record.uploads += 1
+                self.totals["uploads"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(
+                self.totals,
+                tracked_hosts=len(self._hosts),
+                hosts={
+                    host: {
+                        "url_sent": record.url_sent,
+                        "url_failed": record.url_failed,
+                        "uploads": record.uploads
+                    }
+                    for host, record in sorted(
+                        self._hosts.items(),
+                        key=lambda item: item[1].url_sent + item[1].url_failed + item[1].uploads,
+                        reverse=True
+                    )[:20]
+                }
+            )
@@ -0,0 +1,222 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+import logging
+import multiprocessing
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from PIL import Image
+import requests
+from utils.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+MAX_SIZE = (800, 800)
+JPEG_QUALITY = 85
+MAX_PIXELS = 40_000_000
+
+class ImageTooLarge(Exception):
+    """The image exceeds the download size or pixel limit and is sent as text only"""
+
+def resize_image(data: bytes, max_size: Tuple[int, int] = MAX_SIZE, quality: int = JPEG_QUALITY,
+                 max_pixels: int = MAX_PIXELS) -> bytes:
+    """Downscale an image to fit ``max_size`` and re-encode it as JPEG.
+
+    Runs in the image process pool, so it must stay importable without the
+    rest of the webhook service.
+    """
+    image = Image.open(BytesIO(data))
+    # open() only parses the header; refuse decompression bombs before decoding
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageTooLarge(f"{width}x{height} image exceeds {max_pixels} pixels")
+    if image.format == 'JPEG':
+        # Let the decoder skip detail we'd throw away anyway (1/2, 1/4 or 1/8 scale)
+        image.draft('RGB', max_size)
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    # Cheap integer reduce down to twice the target, then LANCZOS for the rest
+    image.thumbnail(max_size, Image.LANCZOS, reducing_gap=2.0)
+    image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=quality)
+    return output.getvalue()
+
+class ImageDownloader:
+    """Streams images from arbitrary NFT metadata URLs with a hard size cap.
+
+    A declared ``Content-Length`` over ``max_bytes`` is rejected before any
+    body is read, and the stream is aborted as soon as it grows past the cap,
+    so a single download never buffers more than ``max_bytes``. Bytes held by
+    in-flight downloads are reported in ``stats``.
+    """
+
+    def __init__(self, max_bytes: int = 5 * 1024 * 1024, timeout: float = 10.0,
+                 chunk_size: int = 64 * 1024):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self.peak_in_flight_bytes = 0
+        self.downloaded = 0
+        self.rejected_length = 0
+        self.aborted = 0
+
+    def _track(self, delta: int) -> None:
+        with self._lock:
+            self.in_flight_bytes += delta
+            self.peak_in_flight_bytes = max(self.peak_in_flight_bytes, self.in_flight_bytes)
+
+    def fetch(self, url: str) -> bytes:
+        with self._lock:
+            self.in_flight += 1
+        held = 0
+        try:
+            with requests.get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                length = response.headers.get('Content-Length')
+                if length and length.isdigit() and int(length) > self.max_bytes:
+                    with self._lock:
+                        self.rejected_length += 1
+                    raise ImageTooLarge(f"Content-Length {length} exceeds {self.max_bytes} bytes")
+
+                chunks = []
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if held + len(chunk) > self.max_bytes:
+                        with self._lock:
+                            self.aborted += 1
+                        raise ImageTooLarge(f"Download exceeded {self.max_bytes} bytes")
+                    chunks.append(chunk)
+                    held += len(chunk)
+                    self._track(len(chunk))
+
+            with self._lock:
+                self.downloaded += 1
+            return b''.join(chunks)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.in_flight_bytes -= held
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "in_flight_bytes": self.in_flight_bytes,
+                "peak_in_flight_bytes": self.peak_in_flight_bytes,
+                "max_bytes": self.max_bytes,
+                "downloaded": self.downloaded,
+                "rejected_length": self.rejected_length,
+                "aborted": self.aborted
+            }
+
+def _warm_up() -> None:
+    pass
+
+class ImageProcessor:
+    """Bounded process pool for image decode/resize, keeping it off request threads.
+
+    Pillow holds the GIL while decoding and resampling, so doing it in worker
+    processes keeps the webhook and sender threads responsive and uses every
+    core. A job that takes longer than ``timeout`` seconds raises TimeoutError.
+
+    The workers are forked once by ``start``. Forking a process that runs
+    threads can leave the child stuck on a lock some other thread held, so
+    the pool is never re-created later: if it breaks (a worker was killed),
+    or was never started, images are resized in the calling thread instead.
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 10.0, max_pixels: int = MAX_PIXELS):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pixels = max_pixels
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._latency = LatencyHistogram()
+        self.processed = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.rejected = 0
+        self.inline = 0
+        self.broken = False
+
+    def start(self) -> None:
+        """Fork the workers; call it before starting the service's own threads"""
+        # Forked rather than spawned: a spawned worker would re-run the
+        # service's main module, MongoDB connection included
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('fork')
+        )
+        for future in [executor.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        with self._lock:
+            self._executor = executor
+        logger.info(f"Started {self.workers} image processing workers")
+
+    def _shutdown_executor(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def process(self, data: bytes) -> bytes:
+        started = time.monotonic()
+        with self._lock:
+            executor = self._executor
+        if executor is None:
+            with self._lock:
+                self.inline += 1
+            future = None
+        else:
+            future = executor.submit(resize_image, data, max_pixels=self.max_pixels)
+        try:
+            if future is None:
+                result = resize_image(data, max_pixels=self.max_pixels)
+            else:
+                result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); not re-forked, see above
+            logger.error("Image process pool broke, resizing images in-process from now on")
+            self._shutdown_executor()
+            with self._lock:
+                self.broken = True
+                self.errors += 1
+            raise
+        except ImageTooLarge:
+            with self._lock:
+                self.rejected += 1
+            raise
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+
+        self._latency.observe(time.monotonic() - started)
+        with self._lock:
+            self.processed += 1
+        return result
+
+    def shutdown(self) -> None:
+        self._shutdown_executor()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "processed": self.processed,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "inline": self.inline,
+                "broken": self.broken,
+                "latency": self._latency.snapshot()
+            }
@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+class MessageLogWriter:
+    """Buffers message log records and writes them with unordered insert_many.
+
+    A background thread flushes every ``flush_interval`` seconds, or as soon
+    as ``flush_size`` records are waiting, so senders never block on Mongo.
+    Records that fail to write for reasons other than a per-document error
+    are put back, up to ``max_buffer`` records.
+    """
+
+    def __init__(self, collection, flush_size: int = 100, flush_interval: float = 1.0,
+                 max_buffer: int = 10000):
+        self.collection = collection
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.written = 0
+        self.dropped = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def add(self, entry: Dict) -> None:
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                logger.error("Message log buffer is full, dropping record")
+                return
+            self._buffer.append(entry)
+            if len(self._buffer) >= self.flush_size:
+                self._wakeup.set()
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+
+            started = time.monotonic()
+            written = len(batch)
+            try:
+                self.collection.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                written -= len(write_errors)
+                logger.error(f"Failed to write {len(write_errors)} message log records: {write_errors[:1]}")
+            except Exception as e:
+                logger.error(f"Error writing message log batch of {len(batch)}: {e}")
+                with self._lock:
+                    room = self.max_buffer - len(self._buffer)
+                    self._buffer = batch[:room] + self._buffer
+                    self.dropped += max(len(batch) - room, 0)
+                return 0
+            latency = time.monotonic() - started
+
+            with self._lock:
+                self.batches += 1
+                self.written += written
+                self.last_batch_size = len(batch)
+                self.max_batch_size = max(self.max_batch_size, len(batch))
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+            logger.info(f"Wrote {written} message log records in {latency * 1000:.1f}ms")
+            return written
+
+    def _flush_loop(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._flush_loop, name="message-log", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "pending": len(self._buffer),
+                "batches": self.batches,
+                "written": self.written,
+                "dropped": self.dropped,
+                "last_batch_size": self.last_batch_size,
+                "max_batch_size": self.max_batch_size,
+                "avg_batch_size": self.written / self.batches if self.batches else 0.0,
+                "avg_latency_ms": self.total_latency / self.batches * 1000 if self.batches else 0.0,
+                "max_latency_ms": self.max_latency * 1000
+            }
@@ -0,0 +1,53 @@
+import bisect
+import threading
+from typing import Dict, Sequence
+
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class LatencyHistogram:
+    """Thread-safe latency histogram with fixed bucket upper bounds in seconds"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._count += 1
+            self._sum += seconds
+            self._max = max(self._max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Upper bucket bound below which ``q`` of observations fall"""
+        with self._lock:
+            if not self._count:
+                return 0.0
+            target = q * self._count
+            seen = 0
+            for bound, count in zip(self.buckets, self._counts):
+                seen += count
+                if seen >= target:
+                    return bound
+            return self._max
+
+    def snapshot(self) -> Dict:
+        p50 = self.quantile(0.5)
+        p95 = self.quantile(0.95)
+        p99 = self.quantile(0.99)
+        with self._lock:
+            buckets = {f"le_{bound}": count for bound, count in zip(self.buckets, self._counts)}
+            buckets["le_inf"] = self._counts[-1]
+            return {
+                "count": self._count,
+                "avg_seconds": self._sum / self._count if self._count else 0.0,
+                "max_seconds": self._max,
+                "p50_seconds": p50,
+                "p95_seconds": p95,
+                "p99_seconds": p99,
+                "buckets": buckets
+            }
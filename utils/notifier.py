@@ -0,0 +1,90 @@
+from io import BytesIO
+import logging
+import threading
+from typing import Callable, Optional
+from telegram import Bot
+from telegram.error import RetryAfter
+from telegram.utils.request import Request
+from utils.rate_limiter import SendGovernor
+
+logger = logging.getLogger(__name__)
+
+class TelegramNotifier:
+    """Process-wide Telegram sender sharing one Bot and its connection pool.
+
+    The Bot is created on first use so importing the webhook service doesn't
+    require a valid token. ``pool_size`` should cover every thread that sends
+    concurrently, otherwise urllib3 will block or open throwaway connections.
+    With a ``governor`` every call waits for a rate-limit slot, and a
+    ``RetryAfter`` from Telegram pauses sending and retries the call up to
+    ``max_rate_limit_retries`` times.
+    """
+
+    def __init__(self, token: str, pool_size: int = 8,
+                 connect_timeout: float = 5.0, read_timeout: float = 10.0,
+                 governor: Optional[SendGovernor] = None, max_rate_limit_retries: int = 5):
+        self.token = token
+        self.governor = governor
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._bot: Optional[Bot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def bot(self) -> Bot:
+        if self._bot is None:
+            with self._lock:
+                if self._bot is None:
+                    request = Request(
+                        con_pool_size=self.pool_size,
+                        connect_timeout=self.connect_timeout,
+                        read_timeout=self.read_timeout
+                    )
+                    self._bot = Bot(self.token, request=request)
+                    logger.info(f"Created Telegram bot with connection pool of {self.pool_size}")
+        return self._bot
+
+    def _call(self, user_id: str, send: Callable):
+        attempt = 0
+        while True:
+            if self.governor:
+                self.governor.acquire(user_id)
+            try:
+                return send()
+            except RetryAfter as e:
+                attempt += 1
+                if not self.governor or attempt > self.max_rate_limit_retries:
+                    raise
+                self.governor.backoff(e.retry_after)
+
+    def send_message(self, user_id: str, text: str):
+        return self._call(user_id, lambda: self.bot.send_message(
+            chat_id=user_id,
+            text=text,
+            parse_mode="Markdown",
+            disable_web_page_preview=True))
+
+    def send_photo(self, user_id: str, photo, caption: Optional[str],
+                   reply_to_message_id: Optional[int] = None, disable_notification: bool = False):
+        """Send a photo by file_id, URL or raw ``bytes``.
+
+        Bytes get a fresh stream on every attempt: the upload reads the
+        stream to the end, so a retried send would otherwise upload nothing.
+        """
+        return self._call(user_id, lambda: self.bot.send_photo(
+            chat_id=user_id,
+            photo=BytesIO(photo) if isinstance(photo, bytes) else photo,
+            caption=caption,
+            parse_mode="Markdown",
+            reply_to_message_id=reply_to_message_id,
+            disable_notification=disable_notification))
+
+    def edit_message_text(self, user_id: str, message_id: int, text: str):
+        return self._call(user_id, lambda: self.bot.edit_message_text(
+            text,
+            chat_id=user_id,
+            message_id=message_id,
+            parse_mode="Markdown",
+            disable_web_page_preview=True))
@@ -0,0 +1,204 @@
+from datetime import datetime, timedelta
+import logging
+import random
+import threading
+from typing import Callable, Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+class OutboxState:
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+    DEAD = "dead"
+
+class NotificationOutbox:
+    """Durable record of every notification until Telegram accepts it.
+
+    Notifications are stored as ``pending`` before they are handed to the
+    sender, which ``claim``s each one (``pending`` -> ``sending``) right
+    before sending it. A failed send is retried by a background thread with exponential
+    backoff until ``max_attempts``, after which it becomes ``dead`` and shows
+    up in ``dead_letters``. A notification still ``pending`` after
+    ``stale_after`` seconds (its process died before sending it) or
+    ``sending`` for that long (it died mid-send) is dispatched again. Every
+    dispatch bumps ``dispatches`` and a claim must match it, so only the
+    latest dispatch of a notification can send it. Sent notifications expire after ``sent_ttl`` seconds.
+    """
+
+    def __init__(self, db, max_attempts: int = 6, base_delay: float = 5.0,
+                 max_delay: float = 1800.0, stale_after: int = 600,
+                 poll_interval: float = 5.0, sent_ttl: int = 7 * 86400):
+        self.collection = db.outbox
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self.sent_ttl = sent_ttl
+        self._dispatch: Optional[Callable[[Dict], None]] = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def ensure_indexes(self) -> None:
+        try:
+            self.collection.create_index(
+                [("state", ASCENDING), ("next_attempt_at", ASCENDING)], background=True
+            )
+            self.collection.create_index(
+                [("state", ASCENDING), ("claimed_at", ASCENDING)], background=True
+            )
+            self.collection.create_index(
+                "sent_at", expireAfterSeconds=self.sent_ttl, background=True
+            )
+        except Exception as e:
+            logger.error(f"Error creating outbox indexes: {e}")
+
+    def add_many(self, notifications: List[Dict]) -> List[Dict]:
+        """Store ``notifications`` as pending and return them with their ``_id``"""
+        if not notifications:
+            return []
+        now = datetime.now()
+        docs = [
+            dict(
+                notification,
+                state=OutboxState.PENDING,
+                attempts=0,
+                created_at=now,
+                claimed_at=now,
+                dispatches=0,
+                next_attempt_at=None,
+                last_error=None
+            )
+            for notification in notifications
+        ]
+        self.collection.insert_many(docs, ordered=False)
+        return docs
+
+    def claim(self, doc: Dict) -> Optional[Dict]:
+        """Mark a dispatched notification as being sent; None if it was already
+        sent or dispatched again since, in which case the caller skips it"""
+        return self.collection.find_one_and_update(
+            {"_id": doc["_id"], "state": OutboxState.PENDING, "dispatches": doc.get("dispatches", 0)},
+            {"$set": {"state": OutboxState.SENDING, "claimed_at": datetime.now()}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def mark_sent(self, doc: Dict, message_id: Optional[int] = None) -> None:
+        try:
+            self.collection.update_one(
+                {"_id": doc["_id"]},
+                {
+                    "$set": {"state": OutboxState.SENT, "sent_at": datetime.now(), "message_id": message_id},
+                    "$inc": {"attempts": 1}
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error marking outbox notification {doc['_id']} as sent: {e}")
+
+    def update_content(self, doc: Dict, text: str, image: str) -> None:
+        """Replace the text and image of a notification that hasn't been sent yet"""
+        try:
+            self.collection.update_one(
+                {"_id": doc["_id"], "state": {"$in": [OutboxState.PENDING, OutboxState.FAILED]}},
+                {"$set": {"text": text, "image": image}}
+            )
+        except Exception as e:
+            logger.error(f"Error updating outbox notification {doc['_id']}: {e}")
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+        return delay * random.uniform(0.8, 1.2)
+
+    def mark_failed(self, doc: Dict, error: Exception, permanent: bool = False) -> None:
+        attempts = doc.get("attempts", 0) + 1
+        try:
+            if permanent or attempts >= self.max_attempts:
+                self.collection.update_one(
+                    {"_id": doc["_id"]},
+                    {"$set": {
+                        "state": OutboxState.DEAD,
+                        "attempts": attempts,
+                        "last_error": str(error),
+                        "dead_at": datetime.now()
+                    }}
+                )
+                logger.error(f"Notification {doc['_id']} for user {doc.get('user')} moved to dead letters: {error}")
+                return
+
+            delay = self._backoff(attempts)
+            self.collection.update_one(
+                {"_id": doc["_id"]},
+                {"$set": {
+                    "state": OutboxState.FAILED,
+                    "attempts": attempts,
+                    "last_error": str(error),
+                    "next_attempt_at": datetime.now() + timedelta(seconds=delay)
+                }}
+            )
+            logger.warning(f"Notification {doc['_id']} failed, retrying in {delay:.0f}s: {error}")
+        except Exception as e:
+            logger.error(f"Error marking outbox notification {doc['_id']} as failed: {e}")
+
+    def _claim_due(self) -> Optional[Dict]:
+        now = datetime.now()
+        return self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"state": OutboxState.FAILED, "next_attempt_at": {"$lte": now}},
+                    {
+                        "state": {"$in": [OutboxState.PENDING, OutboxState.SENDING]},
+                        "claimed_at": {"$lt": now - timedelta(seconds=self.stale_after)}
+                    }
+                ]
+            },
+            {"$set": {"state": OutboxState.PENDING, "claimed_at": now}, "$inc": {"dispatches": 1}},
+            sort=[("priority", DESCENDING), ("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _retry_loop(self) -> None:
+        while not self._stopping.wait(self.poll_interval):
+            try:
+                while not self._stopping.is_set():
+                    doc = self._claim_due()
+                    if doc is None:
+                        break
+                    self._dispatch(doc)
+            except Exception as e:
+                logger.error(f"Error dispatching outbox retries: {e}")
+
+    def start(self, dispatch: Callable[[Dict], None]) -> None:
+        """Start re-dispatching due retries and stale in-flight notifications"""
+        self._dispatch = dispatch
+        self.ensure_indexes()
+        self._thread = threading.Thread(target=self._retry_loop, name="outbox-retry", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def dead_letters(self, limit: int = 50) -> List[Dict]:
+        try:
+            return list(self.collection.find(
+                {"state": OutboxState.DEAD},
+                sort=[("dead_at", DESCENDING)],
+                limit=limit
+            ))
+        except Exception as e:
+            logger.error(f"Error getting dead letters: {e}")
+            return []
+
+    def stats(self) -> Dict:
+        try:
+            return {
+                state: self.collection.count_documents({"state": state})
+                for state in (OutboxState.PENDING, OutboxState.SENDING, OutboxState.SENT, OutboxState.FAILED, OutboxState.DEAD)
+            }
+        except Exception as e:
+            logger.error(f"Error getting outbox stats: {e}")
+            return {}
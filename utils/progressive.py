@@ -0,0 +1,62 @@
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class ProgressiveUpdates:
+    """Pairs each quick plain-text notification with its enriched follow-up.
+
+    The plain notification and the enrichment finish in either order, so
+    whichever arrives second decides what happens: an update that's ready
+    before the send replaces the plain text outright, one that arrives after
+    it becomes an edit of the sent message. Entries are keyed by outbox
+    ``_id`` and forgotten after ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl: int = 600, maxsize: int = 100000):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.replaced_before_send = 0
+        self.edits = 0
+
+    def before_send(self, notification_id) -> Optional[Tuple[str, str]]:
+        """The enriched ``(text, image)`` if it's already available, to send instead"""
+        with self._lock:
+            entry = self._entries.get(notification_id)
+            if entry is None or "update" not in entry:
+                return None
+            self._entries.pop(notification_id, None)
+            self.replaced_before_send += 1
+            return entry["update"]
+
+    def after_send(self, notification_id, message_id) -> Optional[Tuple[str, str]]:
+        """Record the plain message; returns an update that arrived meanwhile, to apply as an edit"""
+        with self._lock:
+            entry = self._entries.get(notification_id)
+            if entry is not None and "update" in entry:
+                self._entries.pop(notification_id, None)
+                self.edits += 1
+                return entry["update"]
+            self._entries[notification_id] = {"message_id": message_id}
+            return None
+
+    def enriched(self, notification_id, text: str, image: str) -> Optional[int]:
+        """Record the enriched content; returns the sent message's id if it should be edited now"""
+        with self._lock:
+            entry = self._entries.get(notification_id)
+            if entry is not None and "message_id" in entry:
+                self._entries.pop(notification_id, None)
+                self.edits += 1
+                return entry["message_id"]
+            self._entries[notification_id] = {"update": (text, image)}
+            return None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "tracked": len(self._entries),
+                "replaced_before_send": self.replaced_before_send,
+                "edits": self.edits
+            }
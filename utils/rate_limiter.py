@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Token bucket refilled at ``rate`` tokens per second up to ``capacity``.
+
+    Not thread-safe on its own; SendGovernor guards its buckets with a lock.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is available now"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+class SendGovernor:
+    """Keeps Telegram sends under the global and per-chat rate limits.
+
+    ``acquire`` blocks until the global bucket has a token, so bursts are
+    queued instead of being rejected with 429s. The chat's bucket is charged
+    without waiting (it may go into debt): a worker must never sleep on one
+    busy chat, so the dispatcher holds a chat's jobs back until
+    ``chat_wait`` says its bucket has refilled. When Telegram still answers
+    with ``retry_after``, ``backoff`` pauses all sends for that long.
+    """
+
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1,
+                 per_chat_burst: float = 1, max_chats: int = 100000):
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        # An idle chat's bucket is full again after a few seconds, so it can expire
+        self._chats = TTLCache(maxsize=max_chats, ttl=max(60, per_chat_burst / per_chat_rate * 2))
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.retry_after_events = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        # Re-setting keeps an active chat's bucket from expiring
+        self._chats[chat_id] = bucket
+        return bucket
+
+    def chat_wait(self, chat_id) -> float:
+        """Seconds until ``chat_id`` may be sent to again, 0 if it can be now"""
+        with self._lock:
+            bucket = self._chats.get(chat_id)
+            return bucket.wait_time(time.monotonic()) if bucket is not None else 0.0
+
+    def acquire(self, chat_id, timeout: Optional[float] = None) -> bool:
+        """Wait for a global send slot and charge ``chat_id``; False if ``timeout`` ran out first"""
+        started = time.monotonic()
+        waited = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(self._paused_until - now, self._global.wait_time(now))
+                if wait <= 0:
+                    bucket = self._chat_bucket(chat_id)
+                    bucket._refill(now)
+                    self._global.consume()
+                    bucket.consume()
+                    self.acquired += 1
+                    if waited:
+                        self.throttled += 1
+                        self.throttled_seconds += now - started
+                    return True
+
+            if timeout is not None and time.monotonic() - started + wait > timeout:
+                return False
+            waited = True
+            time.sleep(wait)
+
+    def backoff(self, retry_after: float) -> None:
+        """Pause all sends for ``retry_after`` seconds after a 429 from Telegram"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self.retry_after_events += 1
+        logger.warning(f"Telegram asked us to retry after {retry_after}s, pausing sends")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "throttled_seconds": self.throttled_seconds,
+                "retry_after_events": self.retry_after_events,
+                "paused_for_seconds": max(self._paused_until - time.monotonic(), 0.0),
+                "tracked_chats": len(self._chats)
+            }
@@ -0,0 +1,155 @@
+"""Index bootstrap for the users, wallets and messages collections.
+
+Both services call ``ensure_indexes`` at startup. Run
+``python -m utils.schema --check`` to list missing indexes and the query
+plan chosen for each hot query.
+"""
+import argparse
+import logging
+import sys
+from datetime import datetime
+from typing import Dict, List
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_ONLY = {"status": "active"}
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "wallets": [
+        IndexModel([("address", ASCENDING)], name="address_active",
+                   partialFilterExpression=ACTIVE_ONLY, background=True),
+        IndexModel([("user_id", ASCENDING), ("name", ASCENDING)], name="user_name_active",
+                   partialFilterExpression=ACTIVE_ONLY, background=True),
+        IndexModel([("datetime", DESCENDING)], name="datetime_active",
+                   partialFilterExpression=ACTIVE_ONLY, background=True),
+    ],
+    "users": [
+        IndexModel([("user_id", ASCENDING)], name="user_id", background=True),
+        IndexModel([("plan", ASCENDING)], name="plan", background=True),
+    ],
+    "messages": [
+        IndexModel([("user", ASCENDING), ("datetime", DESCENDING)], name="user_datetime", background=True),
+        IndexModel([("datetime", DESCENDING)], name="datetime", background=True),
+    ],
+}
+
+def _today():
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+# (collection, description, filter factory) for the queries on the hot path
+HOT_QUERIES = [
+    ("wallets", "match watchers for transaction accounts",
+     lambda: {"address": {"$in": ["11111111111111111111111111111111"]}, "status": "active"}),
+    ("wallets", "user's active wallets",
+     lambda: {"user_id": "0", "status": "active"}),
+    ("wallets", "delete wallet by name",
+     lambda: {"user_id": "0", "name": "Wallet", "status": "active"}),
+    ("wallets", "wallets added today",
+     lambda: {"datetime": {"$gte": _today()}, "status": "active"}),
+    ("users", "user lookup",
+     lambda: {"user_id": "0"}),
+    ("users", "premium lookup",
+     lambda: {"user_id": "0", "plan": "premium"}),
+    ("users", "premium user count",
+     lambda: {"plan": "premium"}),
+    ("messages", "user's messages today",
+     lambda: {"user": "0", "datetime": {"$gte": _today()}}),
+    ("messages", "messages today",
+     lambda: {"datetime": {"$gte": _today()}}),
+]
+
+def ensure_indexes(db) -> None:
+    """Create any missing indexes; safe to run on every start"""
+    for collection, indexes in INDEXES.items():
+        try:
+            db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            # An index with the same name but different options already exists
+            logger.error(f"Error creating indexes on {collection}: {e}")
+        except Exception as e:
+            logger.error(f"Error creating indexes on {collection}: {e}")
+            return
+    logger.info("Database indexes are in place")
+
+def missing_indexes(db) -> List[str]:
+    missing = []
+    for collection, indexes in INDEXES.items():
+        existing = db[collection].index_information()
+        for index in indexes:
+            name = index.document["name"]
+            if name not in existing:
+                missing.append(f"{collection}.{name}")
+    return missing
+
+def _plan_summary(plan: Dict) -> str:
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if plan.get("indexName"):
+            stage += f"({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return " <- ".join(stages)
+
+def explain_hot_queries(db) -> List[Dict]:
+    reports = []
+    for collection, description, query in HOT_QUERIES:
+        try:
+            explain = db[collection].find(query()).explain()
+            plan = _plan_summary(explain["queryPlanner"]["winningPlan"])
+            reports.append({
+                "collection": collection,
+                "query": description,
+                "plan": plan,
+                "collection_scan": "COLLSCAN" in plan
+            })
+        except Exception as e:
+            reports.append({
+                "collection": collection,
+                "query": description,
+                "plan": f"error: {e}",
+                "collection_scan": False
+            })
+    return reports
+
+def check(db) -> bool:
+    missing = missing_indexes(db)
+    if missing:
+        print("Missing indexes:")
+        for name in missing:
+            print(f"  {name}")
+    else:
+        print("All indexes present")
+
+    print("\nHot query plans:")
+    reports = explain_hot_queries(db)
+    for report in reports:
+        flag = "  !!" if report["collection_scan"] else "    "
+        print(f"{flag}{report['collection']}: {report['query']}\n      {report['plan']}")
+
+    return not missing and not any(report["collection_scan"] for report in reports)
+
+def main() -> int:
+    from utils.config import MONGODB_URI
+
+    parser = argparse.ArgumentParser(description="Create or check MongoDB indexes")
+    parser.add_argument("--check", action="store_true",
+                        help="report missing indexes and hot query plans without creating anything")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
+    db = client.sol_wallets
+
+    if args.check:
+        return 0 if check(db) else 1
+    ensure_indexes(db)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,231 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class TokenMetadataCache:
+    """Bounded LRU + TTL cache for token metadata keyed by mint.
+
+    Mints Helius doesn't know about are remembered for ``negative_ttl``
+    seconds so they don't cost a request on every webhook either. Prices
+    come from the same metadata response but are kept separately with a much
+    shorter ``price_ttl``. With a ``backend`` (TokenMetadataStore), memory
+    misses are read through the ``token_metadata`` collection before Helius
+    is asked, so a restart doesn't start from an empty cache. Lookups are
+    counted in memory and added to the store's ``seen_count`` with the next
+    write for that mint, or every ``seen_flush_interval`` seconds.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: int = 6 * 3600,
+                 negative_maxsize: int = 5000, negative_ttl: int = 600,
+                 price_ttl: int = 60, backend=None, seen_flush_interval: float = 60.0):
+        self.backend = backend
+        self.seen_flush_interval = seen_flush_interval
+        self._seen: Dict[str, int] = {}
+        self._seen_flushed_at = time.monotonic()
+        self._positive = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._negative = TTLCache(maxsize=negative_maxsize, ttl=negative_ttl)
+        self._prices = TTLCache(maxsize=maxsize, ttl=price_ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.fetched = 0
+
+    def lookup(self, mint: str) -> Tuple[bool, Optional[Dict]]:
+        """Return ``(found, info)``; ``info`` is None for a cached unknown mint"""
+        with self._lock:
+            info = self._positive.get(mint)
+            if info is not None:
+                self.hits += 1
+                return True, info
+            if mint in self._negative:
+                self.negative_hits += 1
+                return True, None
+            self.misses += 1
+            return False, None
+
+    def store(self, mint: str, info: Optional[Dict]) -> None:
+        with self._lock:
+            if info is None:
+                self._negative[mint] = True
+                self._positive.pop(mint, None)
+            else:
+                self._positive[mint] = info
+                self._negative.pop(mint, None)
+
+    def get_many(self, mints: Iterable[str],
+                 fetch_many: Callable[[list], Dict[str, Optional[Dict]]],
+                 price_mints: Iterable[str] = ()) -> Tuple[Dict[str, Optional[Dict]], Dict[str, Optional[float]]]:
+        """Resolve metadata for ``mints`` and prices for ``price_mints``.
+
+        Everything not answerable from memory is read from the store in one
+        query, and whatever is still missing is requested with a single
+        ``fetch_many`` call. It returns ``{mint: entry}`` for each mint it got
+        an answer for, with None marking an unknown mint; mints missing from
+        the result (e.g. a failed request) are left uncached.
+        """
+        mints = set(mints)
+        price_mints = set(price_mints) & mints
+        if self.backend is not None:
+            with self._lock:
+                for mint in mints:
+                    self._seen[mint] = self._seen.get(mint, 0) + 1
+        infos = {}
+        prices = {}
+        to_fetch = []
+
+        for mint in mints:
+            found, info = self.lookup(mint)
+            infos[mint] = info
+            if not found:
+                to_fetch.append(mint)
+            elif info is not None and mint in price_mints:
+                with self._lock:
+                    if mint in self._prices:
+                        prices[mint] = self._prices[mint]
+                    else:
+                        to_fetch.append(mint)
+
+        if to_fetch and self.backend is not None:
+            to_fetch = self._read_through(to_fetch, infos, prices, price_mints)
+
+        if to_fetch:
+            for mint, entry in self._fetch(to_fetch, fetch_many).items():
+                if entry is None:
+                    infos[mint] = None
+                    continue
+                infos[mint] = {key: value for key, value in entry.items() if key != "price"}
+                if mint in price_mints:
+                    prices[mint] = entry.get("price")
+
+        if self.backend is not None:
+            self._flush_seen()
+
+        return infos, prices
+
+    def _flush_seen(self) -> None:
+        """Write the lookup counts to the store once ``seen_flush_interval`` has passed"""
+        with self._lock:
+            if time.monotonic() - self._seen_flushed_at < self.seen_flush_interval:
+                return
+            seen, self._seen = self._seen, {}
+            self._seen_flushed_at = time.monotonic()
+        if not self.backend.touch(seen):
+            # Keep the counts for the next flush
+            with self._lock:
+                for mint, count in seen.items():
+                    self._seen[mint] = self._seen.get(mint, 0) + count
+
+    def get_prices(self, mints: Iterable[str],
+                   fetch_many: Callable[[list], Dict[str, Optional[Dict]]]) -> Dict[str, Optional[float]]:
+        """Resolve just the prices for ``mints`` whose metadata is already known"""
+        prices = {}
+        missing = []
+        with self._lock:
+            for mint in set(mints):
+                if mint in self._prices:
+                    prices[mint] = self._prices[mint]
+                else:
+                    missing.append(mint)
+
+        if missing and self.backend is not None:
+            stored = self.backend.load_many(missing)
+            for mint in list(missing):
+                if "price" in stored.get(mint, {}):
+                    prices[mint] = stored[mint]["price"]
+                    self.store_price(mint, prices[mint])
+                    missing.remove(mint)
+
+        if missing:
+            for mint, entry in self._fetch(missing, fetch_many).items():
+                if entry is not None:
+                    prices[mint] = entry.get("price")
+
+        return prices
+
+    def _fetch(self, mints: List[str],
+               fetch_many: Callable[[list], Dict[str, Optional[Dict]]]) -> Dict[str, Optional[Dict]]:
+        """Call ``fetch_many`` and cache everything it returned"""
+        fetched = fetch_many(mints)
+        with self._lock:
+            self.fetched += len(fetched)
+        if self.backend is not None:
+            # Counts for these mints ride along with the write
+            with self._lock:
+                seen = {mint: self._seen.pop(mint) for mint in fetched if mint in self._seen}
+            self.backend.save_many(fetched, seen)
+        for mint, entry in fetched.items():
+            if entry is None:
+                self.store(mint, None)
+                continue
+            self.store(mint, {key: value for key, value in entry.items() if key != "price"})
+            self.store_price(mint, entry.get("price"))
+        return fetched
+
+    def _apply_stored(self, mint: str, stored: Dict) -> None:
+        if "info" in stored:
+            self.store(mint, stored["info"])
+        elif "unknown" in stored:
+            self.store(mint, None)
+        if "price" in stored:
+            self.store_price(mint, stored["price"])
+
+    def _read_through(self, to_fetch: List[str], infos: Dict, prices: Dict, price_mints: Set[str]) -> List[str]:
+        """Answer what the store can from ``to_fetch`` and return the mints still missing"""
+        stored = self.backend.load_many(to_fetch)
+        missing = []
+        for mint in to_fetch:
+            entry = stored.get(mint, {})
+            self._apply_stored(mint, entry)
+            if "unknown" in entry:
+                infos[mint] = None
+                continue
+            if "info" in entry:
+                infos[mint] = entry["info"]
+            if infos[mint] is None:
+                missing.append(mint)
+            elif mint in price_mints:
+                if "price" in entry:
+                    prices[mint] = entry["price"]
+                else:
+                    missing.append(mint)
+        with self._lock:
+            self.store_hits += len(to_fetch) - len(missing)
+        return missing
+
+    def warm_up(self, limit: int = 1000) -> int:
+        """Preload the ``limit`` most-seen mints from the store, returning how many were loaded"""
+        if self.backend is None:
+            return 0
+        loaded = 0
+        for entry in self.backend.most_seen(limit):
+            if "info" in entry or "unknown" in entry:
+                self._apply_stored(entry["mint"], entry)
+                loaded += 1
+        logger.info(f"Preloaded {loaded} token metadata entries from the store")
+        return loaded
+
+    def store_price(self, mint: str, price: Optional[float]) -> None:
+        with self._lock:
+            self._prices[mint] = price
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self._positive),
+                "negative_size": len(self._negative),
+                "price_size": len(self._prices),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "store_hits": self.store_hits,
+                "fetched": self.fetched,
+                "seen_pending": len(self._seen),
+                "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0
+            }
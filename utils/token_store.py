@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+import logging
+from typing import Dict, Iterable, List, Optional
+from pymongo import DESCENDING, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+INFO_FIELDS = ("symbol", "name", "decimals")
+
+class TokenMetadataStore:
+    """``token_metadata`` collection backing the in-memory token cache across restarts.
+
+    One document per mint (``_id``) with separately timestamped fields:
+    symbol/name/decimals stay valid for ``info_ttl`` seconds, the price for
+    ``price_ttl`` and an unknown-mint marker for ``negative_ttl``. The cache
+    adds its lookup counts to ``seen_count`` so the busiest mints can be
+    preloaded at startup; mints not seen for ``retention`` seconds are expired by Mongo.
+    Errors are logged and treated as misses, Helius stays the source of truth.
+    """
+
+    def __init__(self, db, info_ttl: int = 7 * 86400, price_ttl: int = 60,
+                 negative_ttl: int = 3600, retention: int = 30 * 86400):
+        self.collection = db.token_metadata
+        self.info_ttl = info_ttl
+        self.price_ttl = price_ttl
+        self.negative_ttl = negative_ttl
+        self.retention = retention
+
+    def ensure_indexes(self) -> None:
+        try:
+            self.collection.create_index([("seen_count", DESCENDING)], background=True)
+            self.collection.create_index("last_seen_at", expireAfterSeconds=self.retention, background=True)
+        except Exception as e:
+            logger.error(f"Error creating token metadata indexes: {e}")
+
+    def _parse(self, doc: Dict, now: datetime) -> Dict:
+        """Split a document into whichever of info/unknown/price is still fresh"""
+        result = {}
+        info_updated_at = doc.get("info_updated_at")
+        if info_updated_at:
+            if doc.get("known", True):
+                if now - info_updated_at < timedelta(seconds=self.info_ttl):
+                    result["info"] = {field: doc.get(field) for field in INFO_FIELDS}
+            elif now - info_updated_at < timedelta(seconds=self.negative_ttl):
+                result["unknown"] = True
+        price_updated_at = doc.get("price_updated_at")
+        if price_updated_at and now - price_updated_at < timedelta(seconds=self.price_ttl):
+            result["price"] = doc.get("price")
+        return result
+
+    def load_many(self, mints: Iterable[str]) -> Dict[str, Dict]:
+        """Fresh fields for each stored mint: ``info``, ``unknown`` and/or ``price``"""
+        mints = list(mints)
+        if not mints:
+            return {}
+        now = datetime.now()
+        try:
+            return {
+                doc["_id"]: self._parse(doc, now)
+                for doc in self.collection.find({"_id": {"$in": mints}})
+            }
+        except Exception as e:
+            logger.error(f"Error reading token metadata store: {e}")
+            return {}
+
+    def save_many(self, entries: Dict[str, Optional[Dict]], seen: Optional[Dict[str, int]] = None) -> None:
+        """Store fetched ``{mint: entry}`` results, None marking an unknown mint.
+
+        ``seen`` lookup counts for these mints are added in the same write.
+        """
+        if not entries:
+            return
+        seen = seen or {}
+        now = datetime.now()
+        operations = []
+        for mint, entry in entries.items():
+            if entry is None:
+                fields = {"known": False, "info_updated_at": now}
+            else:
+                fields = {field: entry.get(field) for field in INFO_FIELDS}
+                fields.update(
+                    known=True,
+                    info_updated_at=now,
+                    price=entry.get("price"),
+                    price_updated_at=now
+                )
+            fields["last_seen_at"] = now
+            operations.append(UpdateOne(
+                {"_id": mint},
+                {"$set": fields, "$inc": {"seen_count": seen.get(mint, 0)}},
+                upsert=True
+            ))
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Error writing token metadata store: {e}")
+
+    def touch(self, seen: Dict[str, int]) -> bool:
+        """Add ``{mint: lookups}`` to the stored counts in one bulk write"""
+        if not seen:
+            return True
+        now = datetime.now()
+        try:
+            self.collection.bulk_write([
+                UpdateOne({"_id": mint}, {"$inc": {"seen_count": count}, "$set": {"last_seen_at": now}})
+                for mint, count in seen.items()
+            ], ordered=False)
+            return True
+        except Exception as e:
+            logger.error(f"Error updating token metadata usage: {e}")
+            return False
+
+    def most_seen(self, limit: int) -> List[Dict]:
+        """Fresh fields of the ``limit`` most looked-up mints, each with its ``mint``"""
+        now = datetime.now()
+        try:
+            return [
+                dict(self._parse(doc, now), mint=doc["_id"])
+                for doc in self.collection.find(sort=[("seen_count", DESCENDING)], limit=limit)
+            ]
+        except Exception as e:
+            logger.error(f"Error reading most seen tokens: {e}")
+            return []
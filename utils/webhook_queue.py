@@ -0,0 +1,173 @@
+from datetime import datetime, timedelta
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+from pymongo import ASCENDING, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+class QueueStatus:
+    PENDING = "pending"
+    PROCESSING = "processing"
+    FAILED = "failed"
+
+class WebhookQueue:
+    """Mongo-backed queue of raw webhook payloads drained by worker threads.
+
+    Items are claimed atomically, so several processes can share the same
+    collection. An item whose worker died is picked up again once its lock is
+    older than ``visibility_timeout``. The handler is called with the payload
+    and the item's ``_id``, so it can tell its own retries from new work.
+    """
+
+    def __init__(self, db, handler: Callable[[Any, Any], None], workers: int = 4,
+                 poll_interval: float = 1.0, visibility_timeout: int = 300,
+                 max_attempts: int = 5):
+        self.collection = db.webhook_queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._processed = 0
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self) -> None:
+        try:
+            self.collection.create_index(
+                [("status", ASCENDING), ("available_at", ASCENDING), ("enqueued_at", ASCENDING)],
+                background=True
+            )
+        except Exception as e:
+            logger.error(f"Error creating webhook queue indexes: {e}")
+
+    def enqueue(self, payload: Any):
+        now = datetime.now()
+        result = self.collection.insert_one({
+            "payload": payload,
+            "status": QueueStatus.PENDING,
+            "attempts": 0,
+            "enqueued_at": now,
+            "available_at": now,
+            "locked_at": None
+        })
+        self._wakeup.set()
+        return result.inserted_id
+
+    def _claim(self) -> Optional[Dict]:
+        now = datetime.now()
+        return self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": QueueStatus.PENDING, "available_at": {"$lte": now}},
+                    {
+                        "status": QueueStatus.PROCESSING,
+                        "locked_at": {"$lt": now - timedelta(seconds=self.visibility_timeout)}
+                    }
+                ]
+            },
+            {
+                "$set": {"status": QueueStatus.PROCESSING, "locked_at": now},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("enqueued_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _retry_or_fail(self, item: Dict, error: Exception) -> None:
+        if item.get("attempts", 0) >= self.max_attempts:
+            self.collection.update_one(
+                {"_id": item["_id"]},
+                {"$set": {"status": QueueStatus.FAILED, "error": str(error)}}
+            )
+            logger.error(f"Webhook queue item {item['_id']} failed permanently: {error}")
+            return
+
+        delay = min(2 ** item.get("attempts", 0), 300)
+        self.collection.update_one(
+            {"_id": item["_id"]},
+            {"$set": {
+                "status": QueueStatus.PENDING,
+                "available_at": datetime.now() + timedelta(seconds=delay),
+                "locked_at": None,
+                "error": str(error)
+            }}
+        )
+        logger.warning(f"Webhook queue item {item['_id']} will be retried in {delay}s: {error}")
+
+    def _process(self, item: Dict) -> None:
+        try:
+            self.handler(item["payload"], item["_id"])
+        except Exception as e:
+            logger.error(f"Error processing webhook queue item {item['_id']}: {e}")
+            self._retry_or_fail(item, e)
+            return
+
+        self.collection.delete_one({"_id": item["_id"]})
+        with self._lock:
+            self._processed += 1
+
+    def _worker_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                item = self._claim()
+            except Exception as e:
+                logger.error(f"Error claiming webhook queue item: {e}")
+                item = None
+
+            if item is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            self._process(item)
+
+    def start(self) -> None:
+        self.ensure_indexes()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                name=f"webhook-queue-{i}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} webhook queue workers")
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def stats(self) -> Dict:
+        try:
+            oldest = self.collection.find_one(
+                {"status": QueueStatus.PENDING},
+                sort=[("enqueued_at", ASCENDING)]
+            )
+            oldest_age = (datetime.now() - oldest["enqueued_at"]).total_seconds() if oldest else 0
+            with self._lock:
+                processed = self._processed
+            return {
+                "depth": self.collection.count_documents({"status": QueueStatus.PENDING}),
+                "in_progress": self.collection.count_documents({"status": QueueStatus.PROCESSING}),
+                "failed": self.collection.count_documents({"status": QueueStatus.FAILED}),
+                "oldest_age_seconds": oldest_age,
+                "workers": len(self._threads),
+                "processed": processed
+            }
+        except Exception as e:
+            logger.error(f"Error getting webhook queue stats: {e}")
+            return {
+                "depth": 0,
+                "in_progress": 0,
+                "failed": 0,
+                "oldest_age_seconds": 0,
+                "workers": len(self._threads),
+                "processed": 0
+            }